@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+from contextlib import contextmanager
+
+from senaite.app.supermodel.counters import ActiveCounter
+
+# Marker to raise a `WakeupError` for values without metadata column
+RAISE = object()
+
+_local = threading.local()
+
+
+class WakeupError(RuntimeError):
+    """A SuperModel needs to wake up its object in brain-only mode
+    """
+
+
+# Number of active brain-only blocks in the process
+settings = ActiveCounter()
+
+
+def is_brain_only():
+    """Checks if the brain-only mode is active in the current thread
+    """
+    if not settings.active:
+        return False
+    return bool(getattr(_local, "defaults", None))
+
+
+def get_missing_default():
+    """Returns the value for fields without metadata column
+
+    :returns: the default of the innermost brain-only block or `RAISE`
+    """
+    defaults = getattr(_local, "defaults", None)
+    if not defaults:
+        return RAISE
+    return defaults[-1]
+
+
+@contextmanager
+def brain_only(default=RAISE):
+    """Context manager that forbids SuperModels to wake up their objects
+
+    Within the block, values are looked up exclusively from the catalog
+    metadata. Values without metadata column result in a `WakeupError`,
+    unless a default is given:
+
+    >>> with brain_only(default=None):
+    ...     SuperModel(brain).getClientTitle
+    'Happy Hills'
+    """
+    defaults = getattr(_local, "defaults", None)
+    if defaults is None:
+        defaults = _local.defaults = []
+    defaults.append(default)
+    settings.activate()
+    try:
+        yield
+    finally:
+        settings.deactivate()
+        defaults.pop()
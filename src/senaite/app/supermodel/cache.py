@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import six
+
+from DateTime import DateTime
+from senaite.app.supermodel import logger
+from senaite.app.supermodel.interfaces import ISuperModel
+from senaite.app.supermodel.lazy import LazyList
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+IDENTITY_MAP_KEY = "senaite.app.supermodel.identity_map"
+
+# Default limits of the shared cache
+SHARED_CACHE_SIZE = 10000
+SHARED_CACHE_TTL = 300
+
+# Marker for values that can not be shared
+UNSHAREABLE = object()
+
+_local = threading.local()
+
+# Maximum number of watched UIDs before dead entries are pruned
+MAX_WATCHED = 10000
+
+# UID -> WeakSet of SuperModels with values to invalidate on write
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+# Value types that can be shared across threads as they are
+SHAREABLE_TYPES = six.string_types + six.integer_types + (
+    float, bool, type(None), DateTime)
+
+
+class CachePolicy(object):
+    """Describes how the value of a field is cached
+
+    :param instance: cache the value in the SuperModel
+    :param shared: cache the value in the shared cache (if enabled)
+    :param ttl: seconds until the value expires in the shared cache
+    :param watch: invalidate the cached value when the object is modified
+    """
+
+    def __init__(self, name, instance=True, shared=False, ttl=None,
+                 watch=False):
+        self.name = name
+        self.instance = instance
+        self.shared = shared
+        self.ttl = ttl
+        self.watch = watch
+
+    def __repr__(self):
+        return "<CachePolicy:{}>".format(self.name)
+
+
+# Never cache the value, e.g. for volatile computed fields
+NO_CACHE = CachePolicy("no-cache", instance=False)
+
+# Cache the value only in the SuperModel
+INSTANCE = CachePolicy("instance")
+
+# Cache the value in the SuperModel until the object is modified, also if
+# the SuperModel is not part of an identity map
+INVALIDATE_ON_WRITE = CachePolicy("invalidate-on-write", watch=True)
+
+# Cache the value in the SuperModel and the shared cache
+SHARED = CachePolicy("shared", shared=True)
+
+# Policy of fields without a declared policy
+# NOTE: values are only shared if declared explicitly, because they might
+#       depend on the current user or on other objects
+DEFAULT = CachePolicy("default")
+
+
+def shared(ttl=None):
+    """Returns a policy to cache the value in the shared cache with a TTL
+
+    Only fields whose values neither depend on the current user, e.g. due to
+    catalog searches filtered by roles, nor on other objects must be shared.
+    """
+    return CachePolicy("shared", shared=True, ttl=ttl)
+
+
+class IdentityMap(object):
+    """Keeps track of the SuperModels created for an UID
+
+    SuperModels are stored per class, because each adapter class might
+    expose different values for the same UID.
+    """
+
+    def __init__(self):
+        self._models = {}
+
+    def __len__(self):
+        return sum(map(len, self._models.values()))
+
+    def __contains__(self, uid):
+        return uid in self._models
+
+    def get(self, cls, uid, default=None):
+        """Returns the SuperModel of the given class for the UID
+        """
+        return self._models.get(uid, {}).get(cls, default)
+
+    def add(self, model):
+        """Remember the SuperModel
+        """
+        models = self._models.setdefault(model.uid, {})
+        models[model.__class__] = model
+
+    def find(self, uid):
+        """Returns all SuperModels of the given UID
+        """
+        return list(self._models.get(uid, {}).values())
+
+    def remove(self, uid):
+        """Forget all SuperModels of the given UID
+        """
+        self._models.pop(uid, None)
+
+    def discard(self, model):
+        """Forget the given SuperModel
+        """
+        models = self._models.get(model.uid, {})
+        if models.get(model.__class__) is model:
+            del models[model.__class__]
+        if not models:
+            self._models.pop(model.uid, None)
+
+    def clear(self):
+        """Forget all SuperModels
+        """
+        self._models.clear()
+
+
+def get_request_identity_map(request=None):
+    """Returns the identity map bound to the request
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        return None
+    return IAnnotations(request).get(IDENTITY_MAP_KEY)
+
+
+def get_identity_map():
+    """Returns the active identity map
+
+    The identity map of an enclosing `identity_map` context manager takes
+    precedence over the one bound to the current request.
+
+    :returns: IdentityMap or None if no identity map is active
+    """
+    stack = getattr(_local, "identity_maps", None)
+    if stack:
+        return stack[-1]
+    return get_request_identity_map()
+
+
+def enable_identity_map(request=None):
+    """Bind an identity map to the request
+
+    The identity map is cleared when the request ends.
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        raise ValueError("No request to bind the identity map to")
+    annotations = IAnnotations(request)
+    return annotations.setdefault(IDENTITY_MAP_KEY, IdentityMap())
+
+
+def disable_identity_map(request=None):
+    """Remove and clear the identity map bound to the request
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        return
+    identity_map = IAnnotations(request).pop(IDENTITY_MAP_KEY, None)
+    if identity_map is not None:
+        logger.debug("Clear identity map with {} SuperModels"
+                     .format(len(identity_map)))
+        identity_map.clear()
+
+
+@contextmanager
+def identity_map():
+    """Context manager that activates a new identity map for the block
+
+    >>> with identity_map():
+    ...     SuperModel(uid) is SuperModel(uid)
+    True
+    """
+    stack = getattr(_local, "identity_maps", None)
+    if stack is None:
+        stack = _local.identity_maps = []
+    mapping = IdentityMap()
+    stack.append(mapping)
+    try:
+        yield mapping
+    finally:
+        stack.remove(mapping)
+        mapping.clear()
+
+
+class SharedCache(object):
+    """Process wide LRU cache for processed field values
+
+    The values are stored per (UID, field name, version), where the version
+    denotes the state of the object, e.g. its `_p_serial`. A changed object
+    therefore never hits the values of its previous state. Entries expire
+    after `ttl` seconds and the least recently used ones are evicted when
+    `max_size` is reached.
+
+    The cache is disabled by default.
+    """
+
+    def __init__(self, max_size=SHARED_CACHE_SIZE, ttl=SHARED_CACHE_TTL):
+        self.enabled = False
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._uids = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the value of the key if it is not expired
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.time():
+                self._forget(key)
+                return default
+            # move to the end as the most recently used entry
+            self._entries[key] = entry
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store the value for the key
+        """
+        if ttl is None:
+            ttl = self.ttl
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, value)
+            self._uids.setdefault(key[0], set()).add(key)
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._entries.pop(oldest)
+                self._forget(oldest)
+
+    def invalidate(self, uid, names=None):
+        """Drop the values of the given UID, optionally only of some names
+        """
+        with self._lock:
+            for key in list(self._uids.get(uid, [])):
+                if names and key[1] not in names:
+                    continue
+                self._entries.pop(key, None)
+                self._forget(key)
+
+    def clear(self):
+        """Drop all values
+        """
+        with self._lock:
+            self._entries.clear()
+            self._uids.clear()
+
+    def _forget(self, key):
+        keys = self._uids.get(key[0])
+        if keys is None:
+            return
+        keys.discard(key)
+        if not keys:
+            self._uids.pop(key[0])
+
+
+shared_cache = SharedCache()
+
+
+def enable_shared_cache(max_size=None, ttl=None):
+    """Enable the process wide shared cache
+    """
+    if max_size is not None:
+        shared_cache.max_size = max_size
+    if ttl is not None:
+        shared_cache.ttl = ttl
+    shared_cache.enabled = True
+    return shared_cache
+
+
+def disable_shared_cache():
+    """Disable and clear the process wide shared cache
+    """
+    shared_cache.enabled = False
+    shared_cache.clear()
+
+
+def freeze(value):
+    """Returns a representation of the value that is safe to share
+
+    References are replaced by their UIDs, because SuperModels and content
+    objects are bound to the ZODB connection of a thread. Values that can not
+    be shared, e.g. files, result in `UNSHAREABLE`.
+    """
+    if ISuperModel.providedBy(value):
+        return value.uid
+    if isinstance(value, SHAREABLE_TYPES):
+        return value
+    if isinstance(value, (list, tuple, LazyList)):
+        items = map(freeze, value)
+        if any(item is UNSHAREABLE for item in items):
+            return UNSHAREABLE
+        return items
+    if isinstance(value, dict):
+        items = dict((k, freeze(v)) for k, v in value.items())
+        if any(item is UNSHAREABLE for item in items.values()):
+            return UNSHAREABLE
+        return items
+    return UNSHAREABLE
+
+
+def watch(model):
+    """Remember the SuperModel to invalidate its values on write
+    """
+    with _watchers_lock:
+        if len(_watchers) >= MAX_WATCHED:
+            for uid, models in list(_watchers.items()):
+                if not models:
+                    _watchers.pop(uid)
+        models = _watchers.setdefault(model.uid, weakref.WeakSet())
+        models.add(model)
+
+
+def invalidate(uid, names=None):
+    """Invalidate the cached values of the given UID
+
+    This drops the values in the shared cache and the values of the live
+    SuperModels that are either part of the identity map active in the
+    current thread or that are cached with a policy to invalidate on write.
+
+    NOTE: Other SuperModels are not tracked, because this would cost a
+          registration per SuperModel. Long-lived SuperModels must cache
+          their fields with `INVALIDATE_ON_WRITE` or be flushed explicitly.
+
+    :param uid: UID of the modified object
+    :param names: field names to invalidate or None to invalidate all
+    """
+    names = list(names or [])
+    shared_cache.invalidate(uid, names=names)
+
+    # SuperModels of the active identity map
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        for model in identity_map.find(uid):
+            model.flush(*names)
+
+    # SuperModels with values to invalidate on write
+    with _watchers_lock:
+        models = list(_watchers.get(uid, []))
+
+    for model in models:
+        for name in list(model.data.keys()):
+            if names and name not in names:
+                continue
+            if model.get_cache_policy(name).watch:
+                model.flush(name)
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from Acquisition import aq_base
+from Acquisition import aq_parent
+from bika.lims import api
+from Products.CMFPlone.utils import safe_callable
+from senaite.app.supermodel import logger
+from senaite.app.supermodel.schema import flush_schemas
+from zope.dottedname.resolve import resolve
+
+_marker = object()
+
+# Version of a catalog mapping with uncommitted changes
+UNCOMMITTED = object()
+
+# Special "fields" that are accessed in lowercase, but are stored in the
+# metadata column of their capitalized accessor
+SPECIAL_COLUMNS = {
+    "title": "Title",
+    "description": "Description",
+}
+
+# catalog path -> (column names, {name: column})
+_metadata_columns = {}
+
+# portal_type -> content class
+_type_classes = {}
+
+# (portal path, portal_type) -> (catalog map version, catalog id)
+_primary_catalogs = {}
+
+# Maximum number of remembered UID -> portal_type routes
+MAX_UID_ROUTES = 100000
+
+# UID -> portal_type
+_uid_routes = {}
+
+
+def get_catalog_key(catalog):
+    """Returns a hashable key for the given catalog
+    """
+    return catalog.getPhysicalPath()
+
+
+def is_catalog(thing):
+    """Checks if the passed in object is a catalog tool
+    """
+    return safe_callable(getattr(thing, "schema", None))
+
+
+def get_metadata_columns(catalog):
+    """Returns a mapping of attribute name -> metadata column of the catalog
+
+    Each metadata column is mapped to itself. Columns following the accessor
+    convention, e.g. `getClientTitle`, are additionally mapped to the name of
+    the value they provide, e.g. `ClientTitle`, and take precedence over a
+    column with the same name.
+
+    The mapping is computed once per catalog and computed again when
+    metadata columns are added or removed.
+    """
+    key = get_catalog_key(catalog)
+    names = getattr(getattr(catalog, "_catalog", None), "names", None)
+    cached_names, columns = _metadata_columns.get(key, (None, None))
+    if columns is not None and (cached_names is names or
+                                cached_names == names):
+        return columns
+
+    logger.debug("Build metadata column map for {}".format(repr(catalog)))
+    schema = catalog.schema()
+    columns = dict(zip(schema, schema))
+    for column in schema:
+        if column.startswith("get") and len(column) > 3:
+            columns[column[3:]] = column
+    for name, column in SPECIAL_COLUMNS.items():
+        if column in schema:
+            columns[name] = column
+
+    _metadata_columns[key] = (names, columns)
+    return columns
+
+
+def get_metadata_column(catalog, name, default=None):
+    """Returns the metadata column of the catalog for the given name
+    """
+    if not is_catalog(catalog):
+        return default
+    return get_metadata_columns(catalog).get(name, default)
+
+
+def get_catalog_of(brains):
+    """Returns the catalog tool the given brains were found in
+
+    :raises ValueError: if the brains were found in different catalogs
+    """
+    catalog = None
+    for brain in brains:
+        parent = aq_parent(brain)
+        if catalog is None:
+            catalog = parent
+        elif aq_base(parent) is not aq_base(catalog):
+            raise ValueError("Brains of different catalogs: {}, {}".format(
+                repr(catalog), repr(parent)))
+    return catalog
+
+
+def get_metadata_position(catalog, name):
+    """Returns the position of the name's metadata column in the data records
+
+    :returns: position or None if the catalog has no column for the name
+    """
+    column = get_metadata_column(catalog, name)
+    if column is None:
+        return None
+    return catalog._catalog.schema.get(column)
+
+
+def get_metadata_records(catalog, brains):
+    """Returns the metadata records of the given brains
+
+    The records are the tuples of metadata values stored in the catalog, which
+    can be read by their column position without the attribute lookup of the
+    brains.
+    """
+    data = catalog._catalog.data
+    return [data[brain.getRID()] for brain in brains]
+
+
+def get_catalog_map_version():
+    """Returns the version of the catalog mapping of the archetype_tool
+
+    The modification time of the persistent mapping changes whenever a type
+    is (un)registered for a catalog and the transaction is committed. Before
+    the commit, `UNCOMMITTED` is returned and the cached primary catalogs
+    are not used. Call `flush_metadata_columns` to drop them explicitly.
+    """
+    archetype_tool = api.get_tool("archetype_tool", default=None)
+    catalog_map = getattr(archetype_tool, "catalog_map", None)
+    if getattr(catalog_map, "_p_changed", False):
+        return UNCOMMITTED
+    return getattr(catalog_map, "_p_mtime", None)
+
+
+def get_primary_catalog_key(portal_type):
+    """Returns the cache key of the primary catalog for the portal type
+    """
+    return (api.get_portal().getPhysicalPath(), portal_type)
+
+
+def query_primary_catalog(portal_type, default=None):
+    """Returns the cached primary catalog ID of the given portal type
+    """
+    key = get_primary_catalog_key(portal_type)
+    version, catalog_id = _primary_catalogs.get(key, (None, None))
+    if catalog_id is None or version != get_catalog_map_version():
+        return default
+    return catalog_id
+
+
+def set_primary_catalog(portal_type, catalog_id):
+    """Cache the primary catalog ID of the given portal type
+    """
+    version = get_catalog_map_version()
+    if version is UNCOMMITTED:
+        return
+    key = get_primary_catalog_key(portal_type)
+    _primary_catalogs[key] = (version, catalog_id)
+
+
+def remember_portal_type(uid, portal_type):
+    """Remember the portal type of an UID to route catalog lookups
+
+    The portal type of an object never changes, so that the routes do not
+    need to be invalidated. They are dropped at once when the limit of
+    `MAX_UID_ROUTES` is reached.
+    """
+    if len(_uid_routes) >= MAX_UID_ROUTES:
+        _uid_routes.clear()
+    _uid_routes[uid] = portal_type
+
+
+def lookup_portal_type(uid, default=None):
+    """Returns the remembered portal type of the given UID
+    """
+    return _uid_routes.get(uid, default)
+
+
+def get_catalog_for_uid(uid, default=None):
+    """Returns the primary catalog of the given UID without a catalog query
+
+    This is only possible if the portal type of the UID was remembered and
+    the primary catalog of this portal type is cached.
+    """
+    portal_type = lookup_portal_type(uid)
+    if portal_type is None:
+        return default
+    catalog_id = query_primary_catalog(portal_type)
+    if catalog_id is None:
+        return default
+    return api.get_tool(catalog_id)
+
+
+def get_type_class(portal_type, default=None):
+    """Returns the content class of the given portal type
+
+    The class is looked up in the type registries, so that no object of this
+    type has to be loaded.
+    """
+    klass = _type_classes.get(portal_type, _marker)
+    if klass is not _marker:
+        return default if klass is None else klass
+
+    klass = None
+
+    # Dexterity types provide the dotted name of their class
+    fti = api.get_tool("portal_types").getTypeInfo(portal_type)
+    dotted_name = getattr(fti, "klass", None)
+    if dotted_name:
+        try:
+            klass = resolve(dotted_name)
+        except ImportError:
+            logger.warn("Could not resolve class '{}' of type '{}'"
+                        .format(dotted_name, portal_type))
+
+    # Archetypes types are registered in the archetype_tool
+    if klass is None:
+        archetype_tool = api.get_tool("archetype_tool", default=None)
+        types = archetype_tool.listRegisteredTypes() if archetype_tool else []
+        for info in types:
+            if info.get("portal_type") == portal_type:
+                klass = info.get("klass")
+                break
+
+    _type_classes[portal_type] = klass
+    if klass is None:
+        return default
+    return klass
+
+
+def is_attribute_column(portal_type, column):
+    """Checks if the metadata column can be used in place of the attribute
+
+    This is the case if the content class of the portal type does not define
+    the attribute as a method, because a `SuperModel` must return the bound
+    method of the instance in this case, e.g. for `model.Title`.
+    """
+    klass = get_type_class(portal_type)
+    if klass is None:
+        return False
+    return not safe_callable(getattr(klass, column, None))
+
+
+def flush_metadata_columns():
+    """Flush the cached metadata column maps
+    """
+    _metadata_columns.clear()
+    _type_classes.clear()
+    _primary_catalogs.clear()
+    _uid_routes.clear()
+    # accessor plans refer to the metadata columns
+    flush_schemas()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+from functools import partial
+
+import six
+
+import Missing
+from bika.lims import api
+from DateTime import DateTime
+from Products.CMFPlone.utils import safe_callable
+from Products.CMFPlone.utils import safe_hasattr
+from Products.ZCatalog.Lazy import LazyMap
+from senaite.app.supermodel import logger
+from senaite.app.supermodel.interfaces import ISuperModel
+from senaite.app.supermodel.lazy import LazyList
+from senaite.app.supermodel.lazy import LazyReference
+from senaite.app.supermodel.lazy import to_lazy_reference
+
+# Length of the UIDs of content objects
+UID_LENGTH = 32
+
+MISSING_TYPE = type(Missing.Value)
+
+
+class Dispatcher(object):
+    """Registry of value handlers by type
+
+    The handler of a type is looked up along the MRO of the type and cached,
+    so that subclasses of registered types are handled as well. Types without
+    registered handler are passed to the fallback handler.
+
+    Handlers are called with the SuperModel and the value.
+    """
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self._handlers = {}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, model, value):
+        cls = type(value)
+        handler = self._cache.get(cls)
+        if handler is None:
+            handler = self.lookup(cls)
+        return handler(model, value)
+
+    def lookup(self, cls):
+        """Returns the handler for the given type
+        """
+        handler = self.fallback
+        for base in getattr(cls, "__mro__", (cls, )):
+            if base in self._handlers:
+                handler = self._handlers[base]
+                break
+        self._cache[cls] = handler
+        return handler
+
+    def register(self, types, handler=None):
+        """Register a handler for the given type(s)
+
+        Can be used as a decorator if no handler is given:
+
+        >>> @process_value_handlers.register(Decimal)
+        ... def process_decimal(model, value):
+        ...     return float(value)
+        """
+        if not isinstance(types, (list, tuple)):
+            types = (types, )
+
+        def decorator(func):
+            with self._lock:
+                for cls in types:
+                    self._handlers[cls] = func
+                self._cache.clear()
+            return func
+
+        if handler is None:
+            return decorator
+        return decorator(handler)
+
+    def unregister(self, cls):
+        """Remove the handler of the given type
+        """
+        with self._lock:
+            self._handlers.pop(cls, None)
+            self._cache.clear()
+
+
+def is_uid_list(value):
+    """Checks if the value is a list of UIDs
+    """
+    if not value or not isinstance(value, (list, tuple)):
+        return False
+    return all(map(api.is_uid, value))
+
+
+def get_reference_factory(model):
+    """Returns a function that wraps the items of a LazyList into references
+
+    The references are resolved with the `to_super_model` method of the model.
+    """
+    return partial(to_lazy_reference, factory=model.to_super_model)
+
+
+def process_default(model, value):
+    """Process values of types without registered handler
+    """
+    # Content -> SuperModel
+    if api.is_object(value):
+        return LazyReference(value, factory=model.to_super_model)
+    # Process function
+    elif safe_callable(value):
+        return model.process_value(value())
+    # Always return the unprocessed value last
+    return value
+
+
+def process_string(model, value):
+    # UID -> SuperModel
+    if len(value) == UID_LENGTH and api.is_uid(value):
+        return LazyReference(value, factory=model.to_super_model)
+    # String -> Unicode
+    # NOTE: "0" is not processed as the portal object
+    # -> Side effect in specifications when the value is "0"
+    return six.ensure_str(value)
+
+
+def process_missing(model, value):
+    return None
+
+
+def process_unchanged(model, value):
+    return value
+
+
+def process_lazy_map(model, value):
+    # Catalog results -> lazily wrapped SuperModels
+    return LazyList(value, func=get_reference_factory(model))
+
+
+def process_list(model, value):
+    # UID lists -> lazily wrapped SuperModels
+    if is_uid_list(value):
+        return LazyList(value, func=get_reference_factory(model))
+    return map(model.process_value, value)
+
+
+def process_dict(model, value):
+    return {k: model.process_value(v) for k, v in value.iteritems()}
+
+
+process_value_handlers = Dispatcher(process_default)
+process_value_handlers.register(six.string_types, process_string)
+process_value_handlers.register(MISSING_TYPE, process_missing)
+process_value_handlers.register(DateTime, process_unchanged)
+process_value_handlers.register(
+    six.integer_types + (float, bool, type(None)), process_unchanged)
+process_value_handlers.register(LazyMap, process_lazy_map)
+process_value_handlers.register((list, tuple), process_list)
+process_value_handlers.register(dict, process_dict)
+
+
+def stringify_default(model, value):
+    """Stringify values of types without registered handler
+    """
+    # SuperModel -> UID
+    if ISuperModel.providedBy(value):
+        return str(value)
+    # Image/Files -> filename
+    elif safe_hasattr(value, "filename"):
+        return value.filename
+    # Callables
+    elif safe_callable(value):
+        return model.stringify(value())
+    return stringify_object(model, value)
+
+
+def stringify_object(model, value):
+    try:
+        return str(value)
+    except (AttributeError, TypeError, ValueError):
+        logger.warn("Could not convert {} to string".format(repr(value)))
+        return None
+
+
+def stringify_reference(model, value):
+    # SuperModel -> UID
+    return str(value)
+
+
+def stringify_missing(model, value):
+    # Catalog Missing.Value -> ""
+    return ""
+
+
+def stringify_date(model, value):
+    # DateTime -> ISO8601 format
+    return value.ISO8601()
+
+
+def stringify_string(model, value):
+    return stringify_object(model, six.ensure_str(value))
+
+
+def stringify_dict(model, value):
+    return {k: model.stringify(v) for k, v in value.iteritems()}
+
+
+def stringify_list(model, value):
+    return map(model.stringify, value)
+
+
+stringify_handlers = Dispatcher(stringify_default)
+stringify_handlers.register(LazyReference, stringify_reference)
+stringify_handlers.register(MISSING_TYPE, stringify_missing)
+stringify_handlers.register(DateTime, stringify_date)
+stringify_handlers.register(six.string_types, stringify_string)
+stringify_handlers.register(
+    six.integer_types + (float, bool, type(None)), stringify_object)
+stringify_handlers.register(dict, stringify_dict)
+stringify_handlers.register(
+    (list, tuple, LazyMap, LazyList), stringify_list)
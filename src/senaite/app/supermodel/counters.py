@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+
+
+class ActiveCounter(object):
+    """Thread-safe number of active blocks of a feature in the process
+
+    The SuperModels skip any thread or request specific lookup of a feature
+    as long as no block of it is active.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def activate(self):
+        with self.lock:
+            self.active += 1
+
+    def deactivate(self):
+        with self.lock:
+            self.active = max(self.active - 1, 0)
@@ -19,35 +19,79 @@
 # Some rights reserved, see README and LICENSE.
 
 from bika.lims import api
+from senaite.app.supermodel import instrumentation
+from senaite.app.supermodel.catalog import remember_portal_type
 from senaite.app.supermodel.interfaces import ISuperModel
-from zope.component import queryAdapter
+from zope.component import getSiteManager
+from zope.interface import providedBy
 
+_marker = object()
 
-def returns_super_model(func):
-    """Wraps an object into a SuperModel
+# (portal path, portal_type) -> adapter factory
+_adapter_factories = {}
+
+
+def get_adapter_factory(portal_type, uid):
+    """Returns the SuperModel adapter factory registered for the portal type
+
+    The factory is cached per portal type. The cache is flushed whenever an
+    adapter is (un)registered.
     """
+    key = (api.get_portal().getPhysicalPath(), portal_type)
+    factory = _adapter_factories.get(key, _marker)
+    if factory is _marker:
+        instrumentation.count(instrumentation.ADAPTER_LOOKUP)
+        adapters = getSiteManager().adapters
+        factory = adapters.lookup(
+            (providedBy(uid), ), ISuperModel, name=portal_type)
+        _adapter_factories[key] = factory
+    return factory
+
+
+def flush_adapter_factories():
+    """Flush the cached adapter factories
+    """
+    _adapter_factories.clear()
+
+
+def to_super_model(obj):
+    """Wraps an object into the SuperModel adapter of its portal type
+
+    Catalog brains are passed to the SuperModel, so that the portal type is
+    taken from the metadata and the object is not woken up.
+    """
+    # avoid circular imports
+    from senaite.app.supermodel import SuperModel
+
+    # Object is already a Publication Object, return immediately
+    if ISuperModel.providedBy(obj):
+        return obj
 
-    def to_super_model(obj):
-        # avoid circular imports
-        from senaite.app.supermodel import SuperModel
+    # Only portal objects are supported
+    if not api.is_object(obj):
+        raise TypeError("Expected a portal object, got '{}'"
+                        .format(type(obj)))
 
-        # Object is already a Publication Object, return immediately
-        if isinstance(obj, SuperModel):
-            return obj
+    # Wrap the object into a specific Publication Object Adapter
+    uid = api.get_uid(obj)
+    portal_type = api.get_portal_type(obj)
+    remember_portal_type(uid, portal_type)
 
-        # Only portal objects are supported
-        if not api.is_object(obj):
-            raise TypeError("Expected a portal object, got '{}'"
-                            .format(type(obj)))
+    factory = get_adapter_factory(portal_type, uid)
+    model = factory(uid) if factory is not None else None
+    if model is None:
+        model = SuperModel(uid)
 
-        # Wrap the object into a specific Publication Object Adapter
-        uid = api.get_uid(obj)
-        portal_type = api.get_portal_type(obj)
+    # keep the catalog brain
+    if api.is_brain(obj) and model._brain is None:
+        model._brain = obj
 
-        adapter = queryAdapter(uid, ISuperModel, name=portal_type)
-        if adapter is None:
-            return SuperModel(uid)
-        return adapter
+    return model
+
+
+def returns_super_model(func):
+    """Wraps an object into a SuperModel
+    """
 
     def decorator(*args, **kwargs):
         obj = func(*args, **kwargs)
@@ -56,3 +100,22 @@ def returns_super_model(func):
         return to_super_model(obj)
 
     return decorator
+
+
+def cache_policy(policy, *names):
+    """Class decorator to declare the cache policy of fields
+
+    >>> @cache_policy(NO_CACHE, "Progress")
+    ... class SampleModel(SuperModel):
+    ...     pass
+    """
+
+    def decorator(cls):
+        # do not modify the policies of the base class
+        policies = dict(getattr(cls, "cache_policies", {}))
+        for name in names:
+            policies[name] = policy
+        cls.cache_policies = policies
+        return cls
+
+    return decorator
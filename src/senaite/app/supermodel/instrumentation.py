@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+
+from senaite.app.supermodel import logger
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+STATS_KEY = "senaite.app.supermodel.stats"
+
+# Counter names
+WAKEUP = "wakeup"
+BRAIN_FETCH = "brain_fetch"
+CATALOG_QUERY = "catalog_query"
+CACHE_HIT = "cache_hit"
+CACHE_MISS = "cache_miss"
+ADAPTER_LOOKUP = "adapter_lookup"
+
+# Upper bounds in seconds of the timing histogram buckets
+BUCKETS = (0.001, 0.01, 0.1, 1.0)
+
+# Number of the slowest fields in the log summary
+SUMMARY_FIELDS = 5
+
+_local = threading.local()
+
+
+class Settings(object):
+    """Process wide instrumentation settings
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.timings = False
+
+
+settings = Settings()
+
+
+class Histogram(object):
+    """Distribution of the time spent in an operation
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds):
+        """Record the duration of a call
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        for index, bound in enumerate(BUCKETS):
+            if seconds < bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.buckets[index] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+            "buckets": list(self.buckets),
+        }
+
+
+class Stats(object):
+    """Counters and timings collected during a request
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.timings = {}
+
+    def __nonzero__(self):
+        return bool(self.counters or self.timings)
+
+    __bool__ = __nonzero__
+
+    def count(self, name, amount=1):
+        """Increase the counter of the given name
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        """Record the duration of an operation
+        """
+        histogram = self.timings.get(name)
+        if histogram is None:
+            histogram = self.timings[name] = Histogram()
+        histogram.observe(seconds)
+
+    def to_dict(self):
+        return {
+            "counters": dict(self.counters),
+            "timings": dict((name, histogram.to_dict())
+                            for name, histogram in self.timings.items()),
+        }
+
+    def summary(self):
+        """Returns a single line summary of the counters and slowest fields
+        """
+        parts = ["{}={}".format(name, value)
+                 for name, value in sorted(self.counters.items())]
+        slowest = sorted(self.timings.items(),
+                         key=lambda item: item[1].total, reverse=True)
+        for name, histogram in slowest[:SUMMARY_FIELDS]:
+            parts.append("{}={:.1f}ms/{}".format(
+                name, histogram.total * 1000, histogram.count))
+        return " ".join(parts)
+
+
+def enable_instrumentation(timings=False):
+    """Enable the instrumentation
+
+    :param timings: record the time spent in the field accessors
+    """
+    settings.enabled = True
+    settings.timings = timings
+
+
+def disable_instrumentation():
+    """Disable the instrumentation
+    """
+    settings.enabled = False
+    settings.timings = False
+
+
+def is_enabled():
+    """Checks if the instrumentation is enabled
+    """
+    return settings.enabled
+
+
+def timings_enabled():
+    """Checks if the timings are recorded
+    """
+    return settings.enabled and settings.timings
+
+
+def get_stats(request=None):
+    """Returns the statistics of the request
+
+    Statistics collected outside of a request are bound to the thread.
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        stats = getattr(_local, "stats", None)
+        if stats is None:
+            stats = _local.stats = Stats()
+        return stats
+    return IAnnotations(request).setdefault(STATS_KEY, Stats())
+
+
+def reset_stats(request=None):
+    """Drop the statistics of the request
+
+    :returns: the dropped statistics or None
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        stats = getattr(_local, "stats", None)
+        _local.stats = None
+        return stats
+    return IAnnotations(request).pop(STATS_KEY, None)
+
+
+def count(name, amount=1):
+    """Increase the counter of the given name if instrumentation is enabled
+    """
+    if not settings.enabled:
+        return
+    get_stats().count(name, amount)
+
+
+def observe(name, seconds):
+    """Record the duration of an operation if timings are enabled
+    """
+    if not (settings.enabled and settings.timings):
+        return
+    get_stats().observe(name, seconds)
+
+
+def log_stats(request):
+    """Log the summary of the statistics collected during the request
+    """
+    if not settings.enabled:
+        return
+    stats = reset_stats(request)
+    if not stats:
+        return
+    logger.info("SuperModel stats for {}: {}".format(
+        request.get("ACTUAL_URL", ""), stats.summary()))
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from bika.lims import api
+from senaite.app.supermodel.decorators import to_super_model
+from senaite.app.supermodel.interfaces import ISuperModel
+from six.moves import range
+from zope.interface import implements
+
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+
+
+class LazyReference(object):
+    """Reference to an object that is wrapped into a SuperModel on demand
+
+    The adapter lookup and the fetching of the brain/object is deferred until
+    the first attribute of the reference is accessed.
+
+    The optional `factory` wraps the referenced UID, brain or object into a
+    SuperModel, e.g. the `to_super_model` method of the referencing model.
+    """
+    implements(ISuperModel)
+
+    __slots__ = ("_thing", "_uid", "_model", "_factory")
+
+    def __init__(self, thing, factory=None):
+        self._thing = thing
+        self._uid = thing if api.is_uid(thing) else None
+        self._model = None
+        self._factory = factory
+
+    def resolve(self):
+        """Returns the SuperModel of the referenced object
+        """
+        if self._model is None:
+            from senaite.app.supermodel import SuperModel
+            thing = self._thing
+            if self._factory is not None:
+                model = self._factory(thing)
+            elif api.is_uid(thing):
+                model = SuperModel(thing)
+            else:
+                model = to_super_model(thing)
+            self._model = model
+            self._thing = None
+            self._factory = None
+        return self._model
+
+    @property
+    def uid(self):
+        """UID of the referenced object
+        """
+        if self._uid is None:
+            if self._model is not None:
+                self._uid = self._model.uid
+            else:
+                self._uid = api.get_uid(self._thing)
+        return self._uid
+
+    def __repr__(self):
+        if self._model is not None:
+            return repr(self._model)
+        return "<LazyReference:UID({})>".format(self.uid)
+
+    def __str__(self):
+        return self.uid
+
+    def __hash__(self):
+        return hash(self.uid)
+
+    def __eq__(self, other):
+        return self.uid == getattr(other, "uid", other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+    def __nonzero__(self):
+        # a reference is always true, do not resolve it for `__len__`
+        return True
+
+    __bool__ = __nonzero__
+
+    def __len__(self):
+        return len(self.resolve())
+
+    def __iter__(self):
+        return iter(self.resolve())
+
+
+def to_lazy_reference(thing, factory=None):
+    """Wraps an UID, brain or object into a LazyReference
+
+    Other values are returned unchanged.
+    """
+    # Do not process "0" as the portal object
+    if thing == "0":
+        return thing
+    if api.is_uid(thing) or api.is_object(thing):
+        return LazyReference(thing, factory=factory)
+    return thing
+
+
+def to_resolved_reference(model):
+    """Returns a LazyReference that is already resolved to the SuperModel
+    """
+    reference = LazyReference(model.uid)
+    reference._model = model
+    return reference
+
+
+class LazyList(MutableSequence):
+    """List of items of another sequence that are converted on access
+
+    This allows to keep a `LazyMap` of catalog brains or a list of UIDs
+    unprocessed until the items are actually accessed. The list methods, e.g.
+    `append` or `index`, are supported. The items are converted all at once
+    when the list is modified.
+    """
+
+    def __init__(self, items, func=to_lazy_reference):
+        self._items = items
+        self._func = func
+        self._cache = {}
+
+    def materialize(self):
+        """Convert all items and keep them in a plain list
+        """
+        if self._func is not None:
+            self._items = [self[index] for index in range(len(self))]
+            self._func = None
+            self._cache = {}
+        return self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __nonzero__(self):
+        return len(self) > 0
+
+    __bool__ = __nonzero__
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if self._func is None:
+            return self._items[index]
+        if index < 0:
+            index += len(self)
+        if index not in self._cache:
+            self._cache[index] = self._func(self._items[index])
+        return self._cache[index]
+
+    def __setitem__(self, index, value):
+        self.materialize()[index] = value
+
+    def __delitem__(self, index):
+        del self.materialize()[index]
+
+    def insert(self, index, value):
+        self.materialize().insert(index, value)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __radd__(self, other):
+        return list(other) + list(self)
+
+    def __eq__(self, other):
+        if not isinstance(other, (LazyList, list, tuple)):
+            return False
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return repr(list(self))
+
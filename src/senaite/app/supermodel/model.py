@@ -19,20 +19,61 @@
 # Some rights reserved, see README and LICENSE.
 
 import json
+import logging
+import time
+from collections import OrderedDict
+from itertools import islice
 
 import six
 
 import Missing
+from Acquisition import aq_base
 from bika.lims import api
-from DateTime import DateTime
-from Products.CMFPlone.utils import safe_callable
-from Products.CMFPlone.utils import safe_hasattr
-from Products.ZCatalog.Lazy import LazyMap
+from senaite.app.supermodel import instrumentation
 from senaite.app.supermodel import logger
+from senaite.app.supermodel.brainonly import RAISE
+from senaite.app.supermodel.brainonly import WakeupError
+from senaite.app.supermodel.brainonly import get_missing_default
+from senaite.app.supermodel.brainonly import is_brain_only
+from senaite.app.supermodel.cache import DEFAULT
+from senaite.app.supermodel.cache import UNSHAREABLE
+from senaite.app.supermodel.cache import freeze
+from senaite.app.supermodel.cache import get_identity_map
+from senaite.app.supermodel.cache import shared_cache
+from senaite.app.supermodel.cache import watch
+from senaite.app.supermodel.catalog import get_catalog_for_uid
+from senaite.app.supermodel.catalog import get_catalog_of
+from senaite.app.supermodel.catalog import get_metadata_column
+from senaite.app.supermodel.catalog import get_metadata_position
+from senaite.app.supermodel.catalog import get_metadata_records
+from senaite.app.supermodel.catalog import is_attribute_column
+from senaite.app.supermodel.catalog import is_catalog
+from senaite.app.supermodel.catalog import query_primary_catalog
+from senaite.app.supermodel.catalog import remember_portal_type
+from senaite.app.supermodel.catalog import set_primary_catalog
+from senaite.app.supermodel.converters import is_uid_list
+from senaite.app.supermodel.converters import process_value_handlers
+from senaite.app.supermodel.converters import stringify_handlers
 from senaite.app.supermodel.decorators import returns_super_model
+from senaite.app.supermodel.decorators import to_super_model
 from senaite.app.supermodel.interfaces import ISuperModel
+from senaite.app.supermodel.lazy import LazyList
+from senaite.app.supermodel.lazy import LazyReference
+from senaite.app.supermodel.lazy import to_resolved_reference
+from senaite.app.supermodel.profiling import profiled
+from senaite.app.supermodel.schema import ATTRIBUTE
+from senaite.app.supermodel.schema import AccessorPlan
+from senaite.app.supermodel.schema import FIELD
+from senaite.app.supermodel.schema import GETTER
+from senaite.app.supermodel.schema import Schema
+from senaite.app.supermodel.schema import UNRESOLVED
+from senaite.app.supermodel.schema import get_accessor_plan
+from senaite.app.supermodel.schema import query_schema
+from senaite.app.supermodel.schema import set_schema
+from senaite.app.supermodel.schema import update_accessor_plan
 from senaite.core.catalog import AUDITLOG_CATALOG
 from senaite.core.interfaces import ISenaiteCatalog
+from ZODB.utils import z64
 from zope.interface import implements
 
 _marker = object()
@@ -40,6 +81,16 @@ _no_brain = object()
 
 IGNORE_CATALOGS = [AUDITLOG_CATALOG]
 
+# Attributes of the SuperModel that are never looked up as a field
+INTERNAL_ATTRIBUTES = (
+    "_brain",
+    "_catalog",
+    "_data",
+    "_instance",
+    "_temporary",
+    "_uid",
+)
+
 # Ingore irrelevant fields coming from Archetypes Extensible Metadata
 # -> if required, these fields have to be fetched from the instance itself
 IGNORE_SCHEMA_FIELDS = [
@@ -54,32 +105,76 @@ IGNORE_SCHEMA_FIELDS = [
 ]
 
 
-class SuperModel(object):
-    """Generic wrapper for content objects
+def get_uid_of(thing):
+    """Returns the UID of an UID, brain or object without type sniffing
 
-    This wrapper exposes the schema fields of the wrapped content object as
-    attributes. The schema field values are looked up by their accessors.
+    :returns: UID or None if the UID can not be determined
+    """
+    if isinstance(thing, six.string_types):
+        return thing
+    try:
+        return api.get_uid(thing)
+    except api.APIError:
+        return None
 
-    If the primary catalog of the wrapped object contains a metadata column
-    with the same name as the accessor, the metadata colum value is used
-    instead.
 
-    Note: Adapter lookup is done by `portal_type` name, e.g.:
+def is_instance(thing):
+    """Checks if the thing is a content object, but not an UID or a brain
+    """
+    if isinstance(thing, six.string_types) or api.is_brain(thing):
+        return False
+    return api.is_object(thing)
 
-    >>> portal_type = api.get_portal_type(self.context)
-    >>> adapter = queryAdapter(uid, ISuperModel, name=portal_type)
+
+class SuperModelBase(object):
+    """Behavior of the SuperModel wrappers
+
+    This base class does not define any instance attributes, so that the
+    wrappers can choose to store them in a `__dict__` or in slots.
     """
     implements(ISuperModel)
 
+    __slots__ = ()
+
+    # Cache policies of field names, see `senaite.app.supermodel.cache`
+    cache_policies = {}
+
+    # Share the schema and accessor plans among all objects of the portal
+    # type. Set to False if the schema is extended per instance or browser
+    # layer.
+    cache_schema = True
+
+    def __new__(cls, thing, *args, **kwargs):
+        # return the already built SuperModel if an identity map is active
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            model = identity_map.get(cls, get_uid_of(thing))
+            if model is not None:
+                return model
+        return super(SuperModelBase, cls).__new__(cls)
+
     def __init__(self, thing):
-        # internal cache
-        self._data = {}
+        # SuperModel was already initialized, e.g. from the identity map
+        if getattr(self, "_uid", _marker) is not _marker:
+            # keep the passed in object, e.g. a temporary object that is not
+            # cataloged yet
+            if self._instance is None and is_instance(thing):
+                self._instance = thing
+            return
+
+        # internal cache, allocated on the first write
+        self._data = None
 
         # Type based initializers
-        if isinstance(thing, six.string_types) and thing == "0":
-            self.init_with_instance(api.get_portal())
-        elif api.is_uid(thing):
-            self.init_with_uid(thing)
+        if isinstance(thing, six.string_types):
+            if thing == "0":
+                self.init_with_instance(api.get_portal())
+            elif api.is_uid(thing):
+                self.init_with_uid(thing)
+            else:
+                raise TypeError(
+                    "Can not initialize a SuperModel with '{}'".format(
+                        repr(thing)))
         elif api.is_brain(thing):
             self.init_with_brain(thing)
         elif api.is_object(thing):
@@ -89,6 +184,203 @@ class SuperModel(object):
                 "Can not initialize a SuperModel with '{}'".format(
                     repr(thing)))
 
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            identity_map.add(self)
+
+    @classmethod
+    def from_brain(cls, brain):
+        """Wraps a catalog brain without detecting its type
+
+        The UID and the primary catalog are looked up on demand, so that
+        wrapping many brains costs almost nothing until values are read.
+        """
+        return cls.create(brain, cls.init_with_brain)
+
+    @classmethod
+    def from_object(cls, obj):
+        """Wraps a content object without detecting its type
+        """
+        return cls.create(obj, cls.init_with_instance)
+
+    @classmethod
+    def create(cls, thing, initializer):
+        """Returns a new SuperModel initialized by the given initializer
+
+        Subclasses with an own `__init__` and models of an active identity map
+        are initialized regularly.
+        """
+        init = six.get_unbound_function(cls.__init__)
+        if init is not six.get_unbound_function(SuperModelBase.__init__):
+            return cls(thing)
+        if get_identity_map() is not None:
+            return cls(thing)
+        model = super(SuperModelBase, cls).__new__(cls)
+        model._data = None
+        initializer(model, thing)
+        return model
+
+    @classmethod
+    def from_uids(cls, uids, skip_missing=True):
+        """Returns SuperModels for the given UIDs in the same order
+
+        The catalog brains are fetched with a single query per primary catalog
+        and are set on the returned models.
+
+        :param uids: list of UIDs
+        :param skip_missing: skip UIDs without object or raise a ValueError
+        :returns: list of SuperModels
+        """
+        uids = list(uids)
+        wanted = list(set(filter(lambda uid: uid != "0", uids)))
+
+        # the UID catalog tells us the portal type to find the primary catalog
+        uid_catalog = api.get_tool("uid_catalog")
+        found = []
+        if wanted:
+            instrumentation.count(instrumentation.CATALOG_QUERY)
+            found = uid_catalog({"UID": wanted})
+
+        models = {}
+        catalogs = {}
+        groups = {}
+        for brain in found:
+            uid = api.get_uid(brain)
+            model = cls(uid)
+            portal_type = api.get_portal_type(brain)
+            if portal_type not in catalogs:
+                catalogs[portal_type] = model.get_catalog_for(brain)
+            catalog = catalogs[portal_type]
+            model._catalog = catalog
+            models[uid] = model
+            groups.setdefault(catalog.getId(), (catalog, []))[1].append(uid)
+
+        # fetch the brains with one query per primary catalog
+        for catalog, group in groups.values():
+            instrumentation.count(instrumentation.CATALOG_QUERY)
+            for brain in catalog({"UID": group}):
+                model = models.get(api.get_uid(brain))
+                if model is not None and model._brain is None:
+                    model._brain = brain
+
+        missing = [uid for uid in uids if uid != "0" and uid not in models]
+        if missing:
+            message = "No objects found for UIDs {}".format(
+                ", ".join(map(repr, missing)))
+            if not skip_missing:
+                raise ValueError(message)
+            logger.warn(message)
+
+        out = []
+        for uid in uids:
+            if uid == "0":
+                out.append(cls(uid))
+            elif uid in models:
+                out.append(models[uid])
+        return out
+
+    @classmethod
+    def columns(cls, brains, names, rows=False, converter=None):
+        """Returns the values of the given names for all brains
+
+        Values of metadata columns are read in bulk from the data records of
+        the catalog. Other values are looked up from the objects. All values
+        are processed and converted column by column.
+
+        :param brains: catalog brains of a single catalog
+        :param names: field names or metadata columns
+        :param rows: return a list of value tuples per brain instead
+        :param converter: function to convert the processed values, defaults
+            to `stringify`
+        :returns: dict of name -> list of values or list of row tuples
+        """
+        brains = list(brains)
+        names = list(names)
+        if not brains:
+            return [] if rows else dict((name, []) for name in names)
+
+        catalog = get_catalog_of(brains)
+        records = get_metadata_records(catalog, brains)
+
+        # the model of the first brain processes and converts the values
+        model = cls.from_brain(brains[0])
+        process = model.process_value
+        if converter is None:
+            converter = model.stringify
+
+        columns = []
+        models = None
+        for name in names:
+            position = get_metadata_position(catalog, name)
+            if position is not None:
+                values = []
+                for num, record in enumerate(records):
+                    value = record[position]
+                    # the column was not populated on indexing, get the value
+                    # from the object like `get` does
+                    if value is Missing.Value:
+                        if models is None:
+                            models = map(cls.from_brain, brains)
+                        value = models[num].get(name)
+                    else:
+                        value = process(value)
+                    values.append(value)
+            else:
+                # no metadata column, get the values from the objects
+                if models is None:
+                    models = map(cls.from_brain, brains)
+                values = [item.get(name) for item in models]
+            columns.append(map(converter, values))
+
+        if rows:
+            return zip(*columns)
+        return dict(zip(names, columns))
+
+    @classmethod
+    def iter_batched(cls, query_or_brains, batch_size=100, catalog=None,
+                     cache_gc=True):
+        """Iterate over SuperModels in batches with a bounded memory usage
+
+        The items are wrapped lazily batch by batch. After each batch, the
+        unmodified instances are deactivated and the pickle cache of the ZODB
+        connection is garbage collected. SuperModels that were built for the
+        batch are removed from an active identity map again.
+
+        :param query_or_brains: catalog query or iterable of brains/UIDs
+        :param batch_size: number of items to wrap at once
+        :param catalog: catalog (name) to search if a query is passed in
+        :param cache_gc: garbage collect the connection cache after a batch
+        """
+        if isinstance(query_or_brains, dict):
+            instrumentation.count(instrumentation.CATALOG_QUERY)
+            if catalog is None:
+                query_or_brains = api.search(query_or_brains)
+            else:
+                query_or_brains = api.search(query_or_brains, catalog)
+
+        items = iter(query_or_brains)
+        while True:
+            things = list(islice(items, batch_size))
+            if not things:
+                break
+            # remember the UIDs of the SuperModels built before
+            identity_map = get_identity_map()
+            known = set()
+            if identity_map is not None:
+                known = set(filter(lambda uid: uid in identity_map,
+                                   map(get_uid_of, things)))
+            batch = map(cls, things)
+            things = None
+            for model in batch:
+                yield model
+            for model in batch:
+                model.deactivate_instance()
+                if identity_map is not None and model.uid not in known:
+                    identity_map.discard(model)
+            batch = None
+            if cache_gc:
+                garbage_collect_cache()
+
     def init_with_uid(self, uid):
         """Initialize with an UID
         """
@@ -100,21 +392,26 @@ class SuperModel(object):
 
     def init_with_brain(self, brain):
         """Initialize with a catalog brain
+
+        The UID and the catalog are looked up on demand from the brain.
         """
         self._brain = brain
-        self._catalog = self.get_catalog_for(brain)
+        self._catalog = None
         self._instance = None
-        self._uid = api.get_uid(brain)
+        self._uid = None
         self._temporary = None
 
     def init_with_instance(self, instance):
         """Initialize with an instance object
+
+        The UID, the catalog and the temporary state are looked up on demand
+        from the instance.
         """
         self._brain = None
-        self._catalog = self.get_catalog_for(instance)
+        self._catalog = None
         self._instance = instance
-        self._uid = api.get_uid(instance)
-        self._temporary = api.is_temporary(instance)
+        self._uid = None
+        self._temporary = None
 
     def is_temporary(self, instance):
         """Check if the object is temporary / in initialization
@@ -130,15 +427,13 @@ class SuperModel(object):
 
         Terminates all references for garbage collection
         """
-        logger.debug("Destroying {}".format(repr(self)))
+        # NOTE: `repr` would lookup a missing UID from the instance, which
+        #       might wake up the object again before it is deactivated
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Destroying <{}:UID({})>".format(
+                self.__class__.__name__, self._uid))
 
-        # https://zodb.readthedocs.io/en/latest/api.html#persistent.interfaces.IPersistent
-        if self._instance is not None:
-            changed = getattr(self._instance, "_p_changed", 0)
-            # Object is either in the "Ghost" or in the "Saved" state and can
-            # be safely deactivated
-            if not changed:
-                self._instance._p_deactivate()
+        self.deactivate_instance()
 
         self._brain = None
         self._catalog = None
@@ -146,6 +441,22 @@ class SuperModel(object):
         self._instance = None
         self._uid = None
 
+    def deactivate_instance(self):
+        """Turn the wrapped instance into a ghost if it was not modified
+
+        :returns: True if the instance was deactivated, otherwise False
+        """
+        # https://zodb.readthedocs.io/en/latest/api.html#persistent.interfaces.IPersistent
+        if self._instance is None:
+            return False
+        changed = getattr(self._instance, "_p_changed", 0)
+        # Object is either in the "Ghost" or in the "Saved" state and can
+        # be safely deactivated
+        if changed:
+            return False
+        self._instance._p_deactivate()
+        return True
+
     def __repr__(self):
         return "<{}:UID({})>".format(
             self.__class__.__name__, self.uid)
@@ -166,6 +477,9 @@ class SuperModel(object):
         raise KeyError(key)
 
     def __getattr__(self, name):
+        # internal attributes that are not set yet
+        if name in INTERNAL_ATTRIBUTES:
+            raise AttributeError(name)
         value = self.get(name, _marker)
         if value is not _marker:
             return value
@@ -182,15 +496,7 @@ class SuperModel(object):
             yield k
 
     def keys(self):
-        fields = api.get_fields(self.instance).keys()
-        keys = []
-        for field in fields:
-            if field.startswith("_"):
-                continue
-            if field in IGNORE_SCHEMA_FIELDS:
-                continue
-            keys.append(field)
-        return keys
+        return list(self.get_schema().keys)
 
     def iteritems(self):
         for k in self:
@@ -205,11 +511,35 @@ class SuperModel(object):
     def items(self):
         return list(self.iteritems())
 
+    def get_portal_type(self):
+        """Returns the portal type of the wrapped object
+        """
+        if self._instance is None and self.brain:
+            return api.get_portal_type(self.brain)
+        return api.get_portal_type(self.instance)
+
+    def get_schema(self):
+        """Returns the schema of the wrapped object
+
+        The schema fields are cached per portal type, so that only the first
+        object of a type needs to be woken up for the schema introspection.
+        """
+        if not self.cache_schema:
+            return Schema(api.get_fields(self.instance),
+                          ignore=IGNORE_SCHEMA_FIELDS)
+        portal_type = self.get_portal_type()
+        schema = query_schema(portal_type)
+        if schema is None:
+            fields = api.get_fields(self.instance)
+            schema = set_schema(
+                portal_type, fields, ignore=IGNORE_SCHEMA_FIELDS)
+        return schema
+
     def get_field(self, name, default=None):
         """Returns the instance's field that matches for the given name
         """
         try:
-            fields = api.get_fields(self.instance)
+            fields = self.get_schema().fields
         except api.APIError:
             return default
 
@@ -219,38 +549,268 @@ class SuperModel(object):
 
         return default
 
-    def get_field_value(self, name, default=None):
-        """Returns the value for the given name and current instance
+    def get_accessor_plan(self, name):
+        """Returns the accessor plan of the wrapped portal type for the name
+        """
+        return get_accessor_plan(self.get_portal_type(), name)
+
+    def update_accessor_plan(self, name, **parts):
+        """Publish the compiled parts of the accessor plan for the name
+        """
+        return update_accessor_plan(self.get_portal_type(), name, **parts)
+
+    def compile_accessor(self, name):
+        """Probe the instance for the source of the value of the given name
+
+        :returns: tuple of (source, accessor)
         """
+        instance = self.instance
+        accessor_name = "get{}".format(name)
+        field = self.get_field(name)
+
         # These are special "fields" that are widely accessed in lowercase,
         # but we always need to rely on the capitalized function
         if name in ["title", "description"]:
-            func = getattr(self.instance, name.capitalize(), None)
-            return func() if func else default
-
+            return GETTER, name.capitalize()
         # always give priority to getters regardless of type
-        accessor_name = "get{}".format(name)
-        accessor = getattr(self.instance, accessor_name, _marker)
-        if accessor is not _marker:
-            return accessor()
-
+        if getattr(instance, accessor_name, _marker) is not _marker:
+            return GETTER, accessor_name
         # rely on the fields
-        field = self.get_field(name)
         if field:
-            return field.get(self.instance)
+            return FIELD, field
+        return ATTRIBUTE, name
+
+    def get_field_value(self, name, default=None):
+        """Returns the value for the given name and current instance
+
+        The time spent in the accessor is recorded if the instrumentation
+        timings are enabled.
+        """
+        if not instrumentation.timings_enabled():
+            return self.lookup_field_value(name, default=default)
+        start = time.time()
+        try:
+            return self.lookup_field_value(name, default=default)
+        finally:
+            instrumentation.observe(name, time.time() - start)
+
+    def lookup_field_value(self, name, default=None):
+        """Lookup the value for the given name from the current instance
+
+        The source of the value is probed once per portal type and name.
+        """
+        if not self.cache_schema:
+            source, accessor = self.compile_accessor(name)
+            plan = AccessorPlan(source=source, accessor=accessor)
+        else:
+            plan = self.get_accessor_plan(name)
+        if plan.source is None:
+            source, accessor = self.compile_accessor(name)
+            plan = self.update_accessor_plan(
+                name, source=source, accessor=accessor)
+
+        if plan.source == GETTER:
+            accessor = getattr(self.instance, plan.accessor, None)
+            if accessor is not None:
+                return accessor()
+            # the getter might not be available for all instances of the type
+            if name in ["title", "description"]:
+                return default
+            field = self.get_field(name)
+            return field.get(self.instance) if field else default
+
+        if plan.source == FIELD:
+            return plan.accessor.get(self.instance)
 
         return default
 
+    def get_raw_value(self, name, default=None):
+        """Returns the raw value for the given name
+
+        For reference fields, these are the UIDs of the referenced objects.
+        A metadata column providing the UIDs, e.g. `getClientUID` for the
+        field `Client`, is used before the raw field value of the instance.
+        """
+        value = self.get_metadata_value("{}UID".format(name), default=_marker)
+        if value is not _marker:
+            return value
+
+        field = self.get_field(name)
+        accessor = getattr(field, "getRaw", None)
+        if accessor is None:
+            return default
+
+        return accessor(self.instance)
+
+    def get_metadata_column(self, name):
+        """Returns the primary catalog metadata column for the given name
+        """
+        if name.startswith("_"):
+            return None
+        return get_metadata_column(self.catalog, name)
+
+    def get_metadata_columns(self):
+        """Returns the metadata columns of the primary catalog
+        """
+        catalog = self.catalog
+        if not is_catalog(catalog):
+            return []
+        return catalog.schema()
+
+    def get_brain_value(self, name, default=None):
+        """Returns the value for the given name from the catalog brain
+
+        In contrast to `get_metadata_value`, the brain is also used if the
+        instance was already woken up. References are looked up from the UID
+        metadata column, e.g. `getClientUID` for the field `Client`.
+
+        Columns that were not populated on indexing return `Missing.Value`
+        unprocessed, so that it is converted like in the catalog results.
+        """
+        brain = self.brain
+        if not brain:
+            return default
+
+        column = self.get_metadata_column(name)
+        if column is None:
+            column = self.get_metadata_column("{}UID".format(name))
+            if column is None:
+                return default
+
+        # NOTE: do not acquire unrelated attributes through the brain
+        value = getattr(aq_base(brain), column, _marker)
+        if value is _marker:
+            return default
+        if value is Missing.Value:
+            return value
+
+        return self.process_value(value)
+
+    def get_brain_only_value(self, name, default=None):
+        """Returns the value for the given name in brain-only mode
+
+        The value is looked up from the metadata columns or the attributes of
+        the catalog brain. If neither provides the value, the default of the
+        brain-only mode is returned or a `WakeupError` is raised.
+        """
+        value = self.get_brain_value(name, default=_marker)
+        if value is Missing.Value:
+            return self.process_value(value)
+        if value is not _marker:
+            return value
+
+        if name.startswith("_"):
+            return default
+
+        # NOTE: do not acquire attributes of the catalog or the portal, e.g.
+        #       `absolute_url`, through the acquisition wrapped brain
+        brain = self.brain
+        if brain and getattr(aq_base(brain), name, _marker) is not _marker:
+            return getattr(brain, name)
+
+        missing = get_missing_default()
+        if missing is not RAISE:
+            return missing
+
+        columns = [name, "get{}".format(name), "{}UID".format(name)]
+        raise WakeupError(
+            "Can not get '{}' of {} in brain-only mode: No metadata column "
+            "{} in catalog '{}'".format(
+                name, repr(self), " or ".join(map(repr, columns)),
+                getattr(self.catalog, "id", self.catalog)))
+
+    def compile_metadata_column(self, name):
+        """Returns the metadata column that provides the value for the name
+        """
+        column = self.get_metadata_column(name)
+        # metadata columns with the same name as a method of the instance,
+        # e.g. `Title`, must return the bound method of the instance
+        if column == name:
+            if not is_attribute_column(self.get_portal_type(), column):
+                return None
+        return column
+
+    def get_metadata_value(self, name, default=None):
+        """Returns the value for the given name from the catalog metadata
+
+        The metadata is only used as long as the instance was not woken up.
+        """
+        # the instance is the most recent source once it is loaded
+        if self._instance is not None:
+            return default
+
+        if name.startswith("_"):
+            return default
+
+        # NOTE: we might get no brain here, e.g. for an invalid UID
+        brain = self.brain
+        if not brain:
+            return default
+
+        plan = self.get_accessor_plan(name)
+        if plan.column is UNRESOLVED:
+            plan = self.update_accessor_plan(
+                name, column=self.compile_metadata_column(name))
+
+        column = plan.column
+        if column is None:
+            return default
+
+        # NOTE: do not acquire unrelated attributes through the brain
+        value = getattr(aq_base(brain), column, _marker)
+        # the column was not populated on indexing
+        if value is _marker or value is Missing.Value:
+            return default
+
+        return value
+
+    def get_cache_policy(self, name):
+        """Returns the cache policy for the given name
+        """
+        return self.cache_policies.get(name, DEFAULT)
+
+    @profiled
     def get(self, name, default=None):
+        policy = self.get_cache_policy(name)
+
         # Internal lookup in the data dict
-        value = self.data.get(name, _marker)
+        value = _marker
+        if policy.instance and self._data:
+            value = self._data.get(name, _marker)
 
         # Return the value immediately
         if value is not _marker:
-            return self.data[name]
+            instrumentation.count(instrumentation.CACHE_HIT)
+            return value
 
-        # Try first to lookup the field value from the instance
-        value = self.get_field_value(name, default=_marker)
+        instrumentation.count(instrumentation.CACHE_MISS)
+
+        # Lookup the value exclusively from the catalog brain
+        # NOTE: the value is not cached, because it might be a placeholder or
+        #       a metadata value that differs from the value of the instance
+        if is_brain_only():
+            return self.get_brain_only_value(name, default=default)
+
+        # Try first to lookup the value from the catalog metadata
+        value = self.get_metadata_value(name, default=_marker)
+
+        # Metadata column that matches a plain attribute, e.g. `review_state`
+        if value is not _marker and name == self.get_metadata_column(name):
+            return value
+
+        shareable = False
+        if value is _marker:
+            # Lookup the processed value from the shared cache
+            if policy.shared:
+                value = self.get_shared_value(name, default=_marker)
+            if value is not _marker:
+                if policy.instance:
+                    self.data[name] = value
+                return value
+
+            # Lookup the field value from the instance
+            value = self.get_field_value(name, default=_marker)
+            shareable = policy.shared
 
         if value is _marker:
             # expose non-private members of the instance/brain to have access
@@ -278,48 +838,93 @@ class SuperModel(object):
         # Process value for publication
         value = self.process_value(value)
 
+        # Share the value with other requests
+        if shareable:
+            self.set_shared_value(name, value, ttl=policy.ttl)
+
         # Store value in the internal data dict
-        self.data[name] = value
+        if policy.instance:
+            self.data[name] = value
+            if policy.watch:
+                watch(self)
 
         return value
 
+    def get_version(self):
+        """Returns a marker for the current state of the wrapped object
+
+        This is the `_p_serial` of the instance, which is loaded if needed.
+        The modification date of the catalog brain is not sufficient, because
+        e.g. workflow transitions do not change it.
+
+        :returns: version or None if the state is unknown or not committed
+        """
+        instance = self.instance
+        if instance is None or self.is_temporary(instance):
+            return None
+        changed = getattr(instance, "_p_changed", False)
+        # uncommitted changes
+        if changed:
+            return None
+        # ghosts have no serial before their state is loaded
+        if changed is None:
+            instance._p_activate()
+        serial = getattr(instance, "_p_serial", None)
+        if serial and serial != z64:
+            return ("serial", serial)
+        return None
+
+    def get_shared_key(self, name):
+        """Returns the key of the shared cache for the given name
+        """
+        version = self.get_version()
+        if version is None:
+            return None
+        return (self.uid, name, version)
+
+    def get_shared_value(self, name, default=None):
+        """Returns the processed value from the shared cache
+        """
+        if not shared_cache.enabled:
+            return default
+        key = self.get_shared_key(name)
+        if key is None:
+            return default
+        value = shared_cache.get(key, _marker)
+        if value is _marker:
+            return default
+        return self.process_value(value)
+
+    def set_shared_value(self, name, value, ttl=None):
+        """Store the processed value in the shared cache
+        """
+        if not shared_cache.enabled:
+            return
+        key = self.get_shared_key(name)
+        if key is None:
+            return
+        value = freeze(value)
+        if value is UNSHAREABLE:
+            return
+        shared_cache.set(key, value, ttl=ttl)
+
     def process_value(self, value):
         """Process publication value
+
+        The value is processed by the handler registered for its type in
+        `senaite.app.supermodel.converters.process_value_handlers`.
         """
-        # UID -> SuperModel
-        if api.is_uid(value):
-            # Do not process "0" as the portal object
-            # -> Side effect in specifications when the value is "0"
-            if value == "0":
-                return "0"
-            return self.to_super_model(value)
-        elif value is Missing.Value:
-            return None
-        # Content -> SuperModel
-        elif api.is_object(value):
-            return self.to_super_model(value)
-        # String -> Unicode
-        elif isinstance(value, six.string_types):
-            return six.ensure_str(value)
-        # DateTime -> DateTime
-        elif isinstance(value, DateTime):
-            return value
-        # Process list values
-        elif isinstance(value, (LazyMap, list, tuple)):
-            return map(self.process_value, value)
-        # Process dict values
-        elif isinstance(value, (dict)):
-            return {k: self.process_value(v) for k, v in value.iteritems()}
-        # Process function
-        elif safe_callable(value):
-            return self.process_value(value())
-        # Always return the unprocessed value last
-        return value
+        return process_value_handlers(self, value)
 
     @property
     def uid(self):
         """UID of the wrapped object
         """
+        if self._uid is None:
+            if self._instance is not None:
+                self._uid = api.get_uid(self._instance)
+            elif self._brain not in (None, _no_brain):
+                self._uid = api.get_uid(self._brain)
         return self._uid
 
     @property
@@ -335,7 +940,12 @@ class SuperModel(object):
         """Content instance of the wrapped object
         """
         if self._instance is None:
+            if is_brain_only():
+                raise WakeupError(
+                    "Can not wake up the object of {} in brain-only mode"
+                    .format(repr(self)))
             logger.debug("SuperModel::instance: *Wakup object*")
+            instrumentation.count(instrumentation.WAKEUP)
             self._instance = api.get_object(self.brain)
         return self._instance
 
@@ -346,6 +956,7 @@ class SuperModel(object):
         if self._brain is None:
             try:
                 logger.debug("SuperModel::brain: *Fetch catalog brain*")
+                instrumentation.count(instrumentation.BRAIN_FETCH)
                 self._brain = self.get_brain_by_uid(self.uid)
             except ValueError as exc:
                 logger.warn(exc)
@@ -363,15 +974,34 @@ class SuperModel(object):
         """
         if self._catalog is None:
             logger.debug("SuperModel::catalog: *Fetch catalog*")
-            self._catalog = self.get_catalog_for(self.brain)
+            if self._instance is not None:
+                self._catalog = self.get_catalog_for(self._instance)
+            else:
+                self._catalog = self.get_catalog_for(self.brain)
         return self._catalog
 
     def get_catalog_for(self, brain_or_object, default="uid_catalog"):
         """Return the primary catalog for the given brain or object
+
+        The primary catalog is cached per portal type.
         """
         if not api.is_object(brain_or_object):
             return default
 
+        portal_type = api.get_portal_type(brain_or_object)
+        remember_portal_type(api.get_uid(brain_or_object), portal_type)
+
+        catalog_id = query_primary_catalog(portal_type)
+        if catalog_id is not None:
+            return api.get_tool(catalog_id)
+
+        catalog = self.lookup_catalog_for(brain_or_object, default=default)
+        set_primary_catalog(portal_type, catalog.getId())
+        return catalog
+
+    def lookup_catalog_for(self, brain_or_object, default="uid_catalog"):
+        """Lookup the primary catalog for the given brain or object
+        """
         catalogs = api.get_catalogs_for(brain_or_object, default=default)
 
         # filter out auditlog catalog
@@ -394,8 +1024,13 @@ class SuperModel(object):
         if uid == "0":
             return api.get_portal()
 
+        # route the UID to the primary catalog of its known portal type
+        if self._catalog is None:
+            self._catalog = get_catalog_for_uid(uid)
+
         # ensure we have the primary catalog
         if self._catalog is None:
+            instrumentation.count(instrumentation.CATALOG_QUERY)
             brain = api.get_brain_by_uid(uid, default=_marker)
             if brain is _marker:
                 raise ValueError("No object found for UID '{}'".format(uid))
@@ -403,6 +1038,7 @@ class SuperModel(object):
             self._catalog = self.get_catalog_for(brain)
 
         # Fetch the brain with the primary catalog
+        instrumentation.count(instrumentation.CATALOG_QUERY)
         results = self.catalog({"UID": uid})
         if not results:
             raise ValueError("No results found for UID '{}'".format(uid))
@@ -434,55 +1070,259 @@ class SuperModel(object):
 
         This method is used to generate a simple JSON representation of the
         object (without dereferencing objects etc.)
+
+        The value is converted by the handler registered for its type in
+        `senaite.app.supermodel.converters.stringify_handlers`.
         """
-        # SuperModel -> UID
-        if ISuperModel.providedBy(value):
-            return str(value)
-        # Catalog Missing.Value -> ""
-        elif value is Missing.Value:
-            return ""
-        # DateTime -> ISO8601 format
-        elif isinstance(value, (DateTime)):
-            return value.ISO8601()
-        # Image/Files -> filename
-        elif safe_hasattr(value, "filename"):
-            return value.filename
-        # Dict -> convert_value_to_string
-        elif isinstance(value, dict):
-            return {k: self.stringify(v) for k, v in value.iteritems()}
-        # List -> convert_value_to_string
-        if isinstance(value, (list, tuple, LazyMap)):
-            return map(self.stringify, value)
-        # Callables
-        elif safe_callable(value):
-            return self.stringify(value())
-        elif isinstance(value, six.string_types):
-            value = six.ensure_str(value)
-        try:
-            return str(value)
-        except (AttributeError, TypeError, ValueError):
-            logger.warn("Could not convert {} to string".format(repr(value)))
-            return None
+        return stringify_handlers(self, value)
 
-    def to_dict(self, converter=None):
+    def to_dict(self, converter=None, fields=None, exclude=None,
+                metadata_only=False):
         """Returns a copy dict of the current object
 
         If a converter function is given, pass each value to it.
         Per default the values are converted by `self.stringify`.
+
+        :param fields: field names or dotted paths of referenced fields, e.g.
+            `Client.Name`, to include instead of all schema fields
+        :param exclude: field names or dotted paths to exclude
+        :param metadata_only: include only values of the catalog metadata,
+            so that the object is not woken up
         """
         if converter is None:
             converter = self.stringify
+
+        # the object must not be woken up in brain-only mode
+        metadata_only = metadata_only or is_brain_only()
+
+        if fields is None:
+            if metadata_only:
+                fields = self.get_metadata_columns()
+            else:
+                fields = self.keys()
+
+        excluded = split_paths(exclude or [])
+
         out = dict()
-        for k, v in self.iteritems():
-            out[k] = converter(v)
+        for name, paths in split_paths(fields).items():
+            nested_exclude = excluded.get(name)
+            # excluded field
+            if nested_exclude == []:
+                continue
+
+            value = self.get_converted_value(
+                name, converter, paths, exclude=nested_exclude,
+                metadata_only=metadata_only)
+            if value is not _marker:
+                out[name] = value
         return out
 
-    def to_json(self):
+    @profiled
+    def get_converted_value(self, name, converter, paths, exclude=None,
+                            metadata_only=False):
+        """Returns the converted value of the name for `to_dict`
+
+        :param paths: dotted paths of the referenced fields to project
+        :param exclude: dotted paths of the referenced fields to exclude
+        :returns: converted value or a marker if there is no value
+        """
+        if metadata_only:
+            value = self.get_brain_value(name, default=_marker)
+            if value is _marker:
+                return _marker
+        else:
+            value = self.get(name)
+
+        if paths:
+            return self.project(
+                value, converter, fields=paths, exclude=exclude,
+                metadata_only=metadata_only)
+        return converter(value)
+
+    def project(self, value, converter, **kwargs):
+        """Returns the projected dict(s) of referenced SuperModels
+
+        Keyword arguments are passed to `to_dict` of the referenced models.
+        """
+        if ISuperModel.providedBy(value):
+            return value.to_dict(converter=converter, **kwargs)
+        if isinstance(value, (list, tuple, LazyList)):
+            return [self.project(v, converter, **kwargs) for v in value]
+        return converter(value)
+
+    def to_json(self, fields=None, exclude=None, metadata_only=False):
         """Returns a JSON representation of the current object
         """
-        return json.dumps(self.to_dict())
+        return json.dumps(self.to_dict(
+            fields=fields, exclude=exclude, metadata_only=metadata_only))
 
-    def flush(self):
+    def flush(self, *names):
         """Flush the internal data cache
+
+        If field names are given, only the values of these fields are flushed.
         """
-        self._data = {}
+        if not names:
+            self._data = None
+            return
+        if not self._data:
+            return
+        for name in names:
+            self._data.pop(name, None)
+
+
+class SuperModel(SuperModelBase):
+    """Generic wrapper for content objects
+
+    This wrapper exposes the schema fields of the wrapped content object as
+    attributes. The schema field values are looked up by their accessors.
+
+    If the primary catalog of the wrapped object contains a metadata column
+    with the same name as the accessor, the metadata colum value is used
+    instead.
+
+    Note: Adapter lookup is done by `portal_type` name, e.g.:
+
+    >>> portal_type = api.get_portal_type(self.context)
+    >>> adapter = queryAdapter(uid, ISuperModel, name=portal_type)
+    """
+
+
+class CompactSuperModel(SuperModelBase):
+    """SuperModel that stores its attributes in slots
+
+    This wrapper needs considerably less memory than a `SuperModel`, because
+    it has no instance dictionary. Therefore, no other attributes than the
+    internal ones can be set.
+    """
+    __slots__ = INTERNAL_ATTRIBUTES + ("__weakref__", )
+
+
+def garbage_collect_cache():
+    """Reduce the pickle cache of the ZODB connection to its target size
+    """
+    connection = getattr(api.get_portal(), "_p_jar", None)
+    if connection is None:
+        return
+    connection.cacheGC()
+
+
+def split_paths(paths):
+    """Groups dotted paths by their first field name
+
+    >>> split_paths(["Client", "SampleType.Title", "SampleType.Prefix"])
+    OrderedDict([('Client', []), ('SampleType', ['Title', 'Prefix'])])
+    """
+    tree = OrderedDict()
+    for path in paths:
+        name, _, rest = path.partition(".")
+        nested = tree.setdefault(name, [])
+        if rest:
+            nested.append(rest)
+    return tree
+
+
+def prefetch(models, paths):
+    """Prefetch the referenced SuperModels of the given paths
+
+    The referenced objects of all models are fetched in bulk and stored in the
+    internal data cache of each model. Nested references can be prefetched
+    with dotted paths, e.g.:
+
+    >>> prefetch(models, ["Client", "Contact", "SampleType.title"])
+
+    :param models: list of SuperModels
+    :param paths: list of field names or dotted paths
+    :returns: the list of SuperModels
+    """
+    models = [model for model in models if model is not None]
+
+    for name, nested in split_paths(paths).items():
+        related = prefetch_field(models, name)
+        if nested and related:
+            prefetch(related, nested)
+
+    return models
+
+
+def prefetch_field(models, name):
+    """Prefetch the values of the named field for all models
+
+    The references are stored like `get` does, as lazy references that are
+    already resolved, and only if the cache policy of the field allows it.
+
+    :returns: list of the referenced SuperModels
+    """
+    related = []
+    pending = []
+    uids = set()
+
+    for model in models:
+        value = _marker
+        if model._data and model.get_cache_policy(name).instance:
+            value = model._data.get(name, _marker)
+        if value is _marker:
+            raw = model.get_raw_value(name, default=None)
+            if api.is_uid(raw) and raw != "0":
+                pending.append((model, raw))
+                uids.add(raw)
+                continue
+            if raw and is_uid_list(raw):
+                pending.append((model, raw))
+                uids.update(raw)
+                continue
+            # no references, rely on the default lookup
+            value = model.get(name)
+        # collect the already processed references
+        values = value if isinstance(value, (list, LazyList)) else [value]
+        for item in filter(ISuperModel.providedBy, values):
+            if isinstance(item, LazyReference):
+                item = item.resolve()
+            related.append(item)
+
+    if not pending:
+        return related
+
+    # fetch all referenced objects at once
+    references = {}
+    for reference in SuperModel.from_uids(uids):
+        references[reference.uid] = get_adapted_model(reference)
+
+    def to_reference(uid):
+        reference = references.get(uid)
+        if reference is None:
+            reference = references[uid] = SuperModel(uid)
+        return reference
+
+    def to_lazy_reference(uid):
+        return to_resolved_reference(to_reference(uid))
+
+    for model, raw in pending:
+        if isinstance(raw, (list, tuple)):
+            related.extend(map(to_reference, raw))
+            value = LazyList(raw, func=to_lazy_reference)
+        else:
+            related.append(to_reference(raw))
+            value = to_lazy_reference(raw)
+        policy = model.get_cache_policy(name)
+        if policy.instance:
+            model.data[name] = value
+            if policy.watch:
+                watch(model)
+
+    return related
+
+
+def get_adapted_model(model):
+    """Returns the SuperModel adapter registered for the model's portal type
+
+    The catalog brain and the catalog of the model are passed to the adapter.
+    """
+    brain = model.brain
+    if brain is None:
+        return model
+    adapter = to_super_model(brain)
+    if adapter.__class__ is SuperModel:
+        return model
+    if adapter._catalog is None:
+        adapter._catalog = model._catalog
+    return adapter
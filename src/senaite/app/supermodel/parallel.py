@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+import transaction
+from AccessControl.SecurityManagement import getSecurityManager
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import nobody
+from bika.lims import api
+from senaite.app.supermodel import logger
+from senaite.app.supermodel.cache import identity_map
+from senaite.app.supermodel.decorators import get_adapter_factory
+from senaite.app.supermodel.interfaces import ISuperModel
+from senaite.app.supermodel.lazy import LazyReference
+from senaite.app.supermodel.model import SuperModel
+from senaite.app.supermodel.model import get_uid_of
+from six.moves import range
+from zope.component.hooks import setSite
+from zope.globalrequest import getRequest
+from zope.globalrequest import setRequest
+from ZPublisher.BaseRequest import RequestContainer
+
+# Default number of worker threads
+DEFAULT_WORKERS = 4
+
+
+def partition(items, parts):
+    """Splits the items into at most `parts` contiguous chunks
+
+    >>> partition([1, 2, 3, 4, 5], 2)
+    [[1, 2, 3], [4, 5]]
+    """
+    items = list(items)
+    if not items:
+        return []
+    size = -(-len(items) // max(parts, 1))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def get_snapshot(connection):
+    """Returns the transaction ID the connection reads before
+
+    Worker connections opened before this transaction ID see exactly the same
+    state of the database as the given connection.
+
+    :returns: transaction ID or None if the snapshot can not be determined
+    """
+    before = getattr(connection, "before", None)
+    if before is not None:
+        return before
+    # ZODB 5 connections read through an MVCC adapter
+    storage = getattr(connection, "_storage", None)
+    return getattr(storage, "_start", None)
+
+
+def get_user(contexts, user_id):
+    """Returns the user of the given ID from the first matching user folder
+    """
+    for context in contexts:
+        acl_users = getattr(context, "acl_users", None)
+        if acl_users is None:
+            continue
+        user = acl_users.getUserById(user_id)
+        if user is not None:
+            return user
+    return nobody
+
+
+@contextmanager
+def worker_site(db, before, portal_path, user_id, request=None):
+    """Sets up the site of a worker thread with its own ZODB connection
+
+    The connection is read-only and reads the given snapshot. The models
+    created within the block are kept in an own identity map.
+
+    :param request: request of the worker, e.g. a clone of the request of the
+        calling thread, which must not be shared between threads
+    """
+    transaction_manager = transaction.TransactionManager()
+    connection = db.open(
+        transaction_manager=transaction_manager, before=before)
+    try:
+        app = connection.root()["Application"]
+        if request is not None:
+            app = app.__of__(RequestContainer(REQUEST=request))
+            request["PARENTS"] = [app]
+        portal = app.unrestrictedTraverse(portal_path)
+        setSite(portal)
+        setRequest(request)
+        newSecurityManager(request, get_user([portal, app], user_id))
+        with identity_map():
+            yield portal
+    finally:
+        noSecurityManager()
+        setRequest(None)
+        setSite(None)
+        transaction_manager.abort()
+        connection.close()
+
+
+def to_item(thing):
+    """Returns a tuple of (UID, SuperModel factory) for the given item
+
+    SuperModels and objects are bound to the ZODB connection of the calling
+    thread. Therefore, only the UID and the adapter factory is passed to the
+    workers.
+    """
+    if isinstance(thing, LazyReference):
+        thing = thing.resolve()
+    if ISuperModel.providedBy(thing):
+        return thing.uid, thing.__class__
+    uid = get_uid_of(thing)
+    if uid is None:
+        raise ValueError("Can not determine the UID of {}".format(repr(thing)))
+    if api.is_uid(thing):
+        return uid, SuperModel
+    # brains and objects are wrapped into the adapter of their portal type
+    portal_type = api.get_portal_type(thing)
+    factory = get_adapter_factory(portal_type, uid)
+    return uid, factory or SuperModel
+
+
+def to_model(uid, factory):
+    """Wraps the UID with the given SuperModel factory
+    """
+    model = factory(uid)
+    if model is None:
+        model = SuperModel(uid)
+    return model
+
+
+def to_dicts(things, workers=DEFAULT_WORKERS, **kwargs):
+    """Returns the dicts of the given items converted by parallel workers
+
+    The items are split into contiguous chunks and each chunk is converted by
+    a worker thread with an own ZODB connection. All connections read the
+    same snapshot of the database as the calling thread, so that the result
+    is consistent. Changes that are not committed yet are not visible to the
+    workers. If the snapshot of the calling thread can not be determined, the
+    items are converted sequentially.
+
+    Each worker gets a clone of the current request, because requests are
+    not thread-safe. Statistics and profiles of the current request
+    therefore do not include the work of the workers.
+
+    The workers release the GIL while they wait for objects to be loaded from
+    the storage, which makes this mostly useful for large exports from a ZEO
+    or RelStorage database.
+
+    :param things: iterable of SuperModels, UIDs, brains or objects
+    :param workers: number of worker threads
+    :param kwargs: projection arguments passed to `to_dict`
+    :returns: list of dicts in the order of the given items
+    """
+    items = map(to_item, things)
+    chunks = partition(items, workers)
+
+    portal = api.get_portal()
+    connection = portal._p_jar
+    before = get_snapshot(connection) if connection is not None else None
+    if len(chunks) < 2 or before is None:
+        return [to_model(uid, factory).to_dict(**kwargs)
+                for uid, factory in items]
+
+    db = connection.db()
+    portal_path = portal.getPhysicalPath()
+    user_id = getSecurityManager().getUser().getId()
+
+    # clone the request in the calling thread for each worker
+    request = getRequest()
+    requests = [None] * len(chunks)
+    if request is not None:
+        requests = [request.clone() for chunk in chunks]
+
+    def convert(args):
+        chunk, worker_request = args
+        with worker_site(db, before, portal_path, user_id,
+                         request=worker_request):
+            return [to_model(uid, factory).to_dict(**kwargs)
+                    for uid, factory in chunk]
+
+    logger.debug("Convert {} objects with {} workers"
+                 .format(len(items), len(chunks)))
+
+    pool = ThreadPool(len(chunks))
+    try:
+        results = pool.map(convert, zip(chunks, requests))
+    finally:
+        pool.close()
+        pool.join()
+
+    return [data for chunk in results for data in chunk]
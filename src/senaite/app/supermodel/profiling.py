@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from senaite.app.supermodel import logger
+from senaite.app.supermodel.counters import ActiveCounter
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+PROFILE_KEY = "senaite.app.supermodel.profile"
+
+_local = threading.local()
+
+# Number of active profiles in the process
+settings = ActiveCounter()
+
+
+class Entry(object):
+    """Time spent for a field of a portal type
+    """
+
+    def __init__(self, portal_type, name):
+        self.portal_type = portal_type
+        self.name = name
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        return {
+            "portal_type": self.portal_type,
+            "name": self.name,
+            "calls": self.calls,
+            "total": self.total,
+            "max": self.max,
+        }
+
+
+class Profile(object):
+    """Cumulative and maximum time spent per (portal_type, field name)
+
+    The times include the time spent in nested SuperModels, e.g. to process
+    the value of a reference field or to convert it to a dict.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.running = set()
+
+    def record(self, portal_type, name, seconds):
+        key = (portal_type, name)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = Entry(portal_type, name)
+        entry.record(seconds)
+
+    def sorted_entries(self, limit=None):
+        """Returns the entries sorted by their cumulative time
+        """
+        entries = sorted(self.entries.values(),
+                         key=lambda entry: entry.total, reverse=True)
+        return entries[:limit] if limit else entries
+
+    def report(self, limit=None):
+        """Returns the profile as a text table
+        """
+        lines = ["{:<24} {:<32} {:>8} {:>12} {:>12}".format(
+            "portal_type", "field", "calls", "total ms", "max ms")]
+        for entry in self.sorted_entries(limit=limit):
+            lines.append("{:<24} {:<32} {:>8} {:>12.3f} {:>12.3f}".format(
+                entry.portal_type, entry.name, entry.calls,
+                entry.total * 1000, entry.max * 1000))
+        return "\n".join(lines)
+
+    def to_json(self, limit=None):
+        """Returns the profile as a JSON list
+        """
+        return json.dumps([entry.to_dict()
+                           for entry in self.sorted_entries(limit=limit)])
+
+
+def get_profile():
+    """Returns the active profile
+
+    The profile of an enclosing `profile` context manager takes precedence
+    over the one bound to the current request.
+
+    :returns: Profile or None if no profile is active
+    """
+    stack = getattr(_local, "profiles", None)
+    if stack:
+        return stack[-1]
+    request = getRequest()
+    if request is None:
+        return None
+    return IAnnotations(request).get(PROFILE_KEY)
+
+
+def enable_profiling(request=None):
+    """Bind a profile to the request
+
+    The report is logged when the request ends.
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        raise ValueError("No request to bind the profile to")
+    annotations = IAnnotations(request)
+    if PROFILE_KEY not in annotations:
+        annotations[PROFILE_KEY] = Profile()
+        settings.activate()
+    return annotations[PROFILE_KEY]
+
+
+def disable_profiling(request=None):
+    """Remove the profile bound to the request
+
+    :returns: the removed profile or None
+    """
+    if request is None:
+        request = getRequest()
+    if request is None:
+        return None
+    profile = IAnnotations(request).pop(PROFILE_KEY, None)
+    if profile is not None:
+        settings.deactivate()
+    return profile
+
+
+@contextmanager
+def profile():
+    """Context manager that profiles the SuperModels used in the block
+
+    >>> with profile() as stats:
+    ...     SuperModel(uid).to_dict()
+    >>> print(stats.report())
+    """
+    stack = getattr(_local, "profiles", None)
+    if stack is None:
+        stack = _local.profiles = []
+    current = Profile()
+    stack.append(current)
+    settings.activate()
+    try:
+        yield current
+    finally:
+        settings.deactivate()
+        stack.remove(current)
+
+
+def profiled(func):
+    """Decorator to profile a method of a SuperModel by field name
+
+    The first argument of the method must be the field name. Nested calls for
+    the same portal type and name are only recorded once.
+    """
+
+    @wraps(func)
+    def wrapper(model, name, *args, **kwargs):
+        if not settings.active:
+            return func(model, name, *args, **kwargs)
+        current = get_profile()
+        if current is None:
+            return func(model, name, *args, **kwargs)
+        key = (model.get_portal_type(), name)
+        if key in current.running:
+            return func(model, name, *args, **kwargs)
+        current.running.add(key)
+        start = time.time()
+        try:
+            return func(model, name, *args, **kwargs)
+        finally:
+            current.running.discard(key)
+            current.record(key[0], key[1], time.time() - start)
+
+    return wrapper
+
+
+def log_profile(request):
+    """Log the report of the profile bound to the request
+    """
+    current = disable_profiling(request)
+    if current is None or not current.entries:
+        return
+    logger.info("SuperModel profile for {}:\n{}".format(
+        request.get("ACTUAL_URL", ""), current.report()))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from bika.lims import api
+
+# Sources of an accessor plan
+GETTER = "getter"
+FIELD = "field"
+ATTRIBUTE = "attribute"
+
+# Marker for not yet compiled metadata columns
+UNRESOLVED = object()
+
+# (portal path, portal_type) -> Schema
+_schemas = {}
+
+# (schema key, name) -> AccessorPlan
+_plans = {}
+
+
+class Schema(object):
+    """Schema fields and the public field names of a portal type
+    """
+    __slots__ = ("fields", "keys")
+
+    def __init__(self, fields, ignore=None):
+        ignore = ignore or []
+        self.fields = dict(fields)
+        self.keys = []
+        for name in fields.keys():
+            if name.startswith("_"):
+                continue
+            if name in ignore:
+                continue
+            self.keys.append(name)
+
+
+class AccessorPlan(object):
+    """Describes where the value of a name is looked up for a portal type
+
+    The `column` is the usable metadata column of the primary catalog or
+    None. The `source` tells if the `accessor` is the name of a getter method
+    (`GETTER`), a schema field (`FIELD`) or if the value is a plain attribute
+    of the object (`ATTRIBUTE`).
+
+    Both parts are compiled on first use. The plans are shared between
+    threads and therefore never changed in place: a compiled part is
+    published with a new plan, see `update_accessor_plan`.
+    """
+    __slots__ = ("column", "source", "accessor")
+
+    def __init__(self, column=UNRESOLVED, source=None, accessor=None):
+        self.column = column
+        self.source = source
+        self.accessor = accessor
+
+    def replace(self, **parts):
+        """Returns a new plan with the given parts replaced
+        """
+        values = {
+            "column": self.column,
+            "source": self.source,
+            "accessor": self.accessor,
+        }
+        values.update(parts)
+        return AccessorPlan(**values)
+
+
+# Plan without any compiled parts
+EMPTY_PLAN = AccessorPlan()
+
+
+def get_schema_key(portal_type):
+    """Returns the cache key of the schema for the given portal type
+
+    The cached schemas are flushed when the type information is modified or
+    an adapter, e.g. a schema extender, is (un)registered.
+
+    Schema extenders that extend single instances, e.g. by a marker
+    interface, or that depend on the browser layers of the request can not
+    be considered here. SuperModels of such types must set
+    `cache_schema = False`.
+    """
+    return (api.get_portal().getPhysicalPath(), portal_type)
+
+
+def query_schema(portal_type, default=None):
+    """Returns the cached schema of the given portal type
+    """
+    return _schemas.get(get_schema_key(portal_type), default)
+
+
+def set_schema(portal_type, fields, ignore=None):
+    """Cache the schema fields of the given portal type
+    """
+    schema = Schema(fields, ignore=ignore)
+    _schemas[get_schema_key(portal_type)] = schema
+    return schema
+
+
+def get_accessor_plan(portal_type, name):
+    """Returns the accessor plan of the given portal type and name
+
+    The plans are flushed together with the cached schemas.
+    """
+    return _plans.get((get_schema_key(portal_type), name), EMPTY_PLAN)
+
+
+def update_accessor_plan(portal_type, name, **parts):
+    """Publish the compiled parts of the accessor plan in a single step
+
+    :returns: the new accessor plan
+    """
+    key = (get_schema_key(portal_type), name)
+    plan = _plans.get(key, EMPTY_PLAN).replace(**parts)
+    _plans[key] = plan
+    return plan
+
+
+def flush_schemas():
+    """Flush all cached schemas and accessor plans
+    """
+    _schemas.clear()
+    _plans.clear()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import json
+
+from bika.lims import api
+from senaite.app.supermodel import decorators
+from senaite.app.supermodel.cache import get_identity_map
+from senaite.app.supermodel.model import SuperModel
+from senaite.app.supermodel.model import get_uid_of
+
+# Output formats
+JSON = "json"
+NDJSON = "ndjson"
+
+CONTENT_TYPES = {
+    JSON: "application/json",
+    NDJSON: "application/x-ndjson",
+}
+
+
+def to_super_model(thing):
+    """Wraps an UID, brain or object into a SuperModel
+
+    Brains and objects are wrapped into the SuperModel adapter of their
+    portal type.
+    """
+    if api.is_uid(thing):
+        return SuperModel(thing)
+    return decorators.to_super_model(thing)
+
+
+def iter_json(things, format=JSON, **kwargs):
+    """Yields the JSON representation of the given items chunk by chunk
+
+    Each item is wrapped into a SuperModel and converted with `to_dict`. The
+    wrapped objects are deactivated right after their conversion and the
+    SuperModels built for the items are removed from an active identity map,
+    so that the memory usage stays flat regardless of the number of items.
+
+    :param things: iterable of SuperModels, UIDs, brains or objects
+    :param format: `JSON` for a JSON array or `NDJSON` for one JSON document
+        per line
+    :param kwargs: projection arguments passed to `to_dict`
+    """
+    if format not in CONTENT_TYPES:
+        raise ValueError("Unknown format '{}'".format(format))
+
+    if format == JSON:
+        yield "["
+
+    for num, thing in enumerate(things):
+        identity_map = get_identity_map()
+        known = identity_map is not None and get_uid_of(thing) in identity_map
+        model = to_super_model(thing)
+        chunk = json.dumps(model.to_dict(**kwargs))
+        model.deactivate_instance()
+        if identity_map is not None and not known:
+            identity_map.discard(model)
+
+        if format == NDJSON:
+            yield chunk + "\n"
+        elif num == 0:
+            yield chunk
+        else:
+            yield "," + chunk
+
+    if format == JSON:
+        yield "]"
+
+
+def write_json(out, things, format=JSON, **kwargs):
+    """Write the JSON representation of the given items to a stream
+
+    The stream can be a file or a Zope response, which receives the matching
+    content type header before the first chunk is written.
+
+    :returns: number of written chunks
+    """
+    set_header = getattr(out, "setHeader", None)
+    if set_header is not None:
+        set_header("Content-Type", CONTENT_TYPES.get(format))
+
+    count = 0
+    for chunk in iter_json(things, format=format, **kwargs):
+        out.write(chunk)
+        count += 1
+    return count
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from bika.lims import api
+from senaite.app.supermodel.cache import disable_identity_map
+from senaite.app.supermodel.cache import invalidate
+from senaite.app.supermodel.decorators import flush_adapter_factories
+from senaite.app.supermodel.instrumentation import log_stats
+from senaite.app.supermodel.profiling import log_profile
+from senaite.app.supermodel.schema import flush_schemas
+from zope.interface.interfaces import IAdapterRegistration
+
+
+def on_end_request(event):
+    """Event handler when a request ends
+
+    Clears the identity map bound to the request and logs the summary of the
+    collected statistics and the profile
+    """
+    disable_identity_map(event.request)
+    log_stats(event.request)
+    log_profile(event.request)
+
+
+def on_component_registration(event):
+    """Event handler when a component is (un)registered
+
+    Flushes the cached schemas and SuperModel adapter factories when an
+    adapter, e.g. a schema extender, is (un)registered
+    """
+    if IAdapterRegistration.providedBy(event.object):
+        flush_schemas()
+        flush_adapter_factories()
+
+
+def on_type_information_modified(fti, event):
+    """Event handler when a type information was modified
+
+    Flushes the cached schemas, e.g. when the schema of a Dexterity type was
+    changed
+    """
+    flush_schemas()
+
+
+def on_object_modified(obj, event):
+    """Event handler when an object was modified
+
+    Invalidates all cached values of the object. The modified attributes
+    described by the event are not sufficient, because other values, e.g.
+    `ClientTitle` or computed getters, might be derived from them.
+    """
+    if not api.is_object(obj):
+        return
+    invalidate(api.get_uid(obj))
+
+
+def on_after_transition(obj, event):
+    """Event handler when a workflow transition was performed
+
+    Invalidates all cached values of the object
+    """
+    if not api.is_object(obj):
+        return
+    invalidate(api.get_uid(obj))
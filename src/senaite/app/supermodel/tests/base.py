@@ -42,6 +42,7 @@ class SimpleTestLayer(PloneSandboxLayer):
         import senaite.app.listing
         import senaite.impress
         import senaite.app.spotlight
+        import senaite.app.supermodel
 
         # Load ZCML
         self.loadZCML(package=bika.lims)
@@ -49,6 +50,7 @@ class SimpleTestLayer(PloneSandboxLayer):
         self.loadZCML(package=senaite.app.listing)
         self.loadZCML(package=senaite.impress)
         self.loadZCML(package=senaite.app.spotlight)
+        self.loadZCML(package=senaite.app.supermodel)
 
         # Install product and call its initialize() function
         zope.installProduct(app, "bika.lims")
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.APP.SUPERMODEL.
+#
+# SENAITE.APP.SUPERMODEL is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2018-2024 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+"""Benchmarks of the SuperModel hot paths
+
+The benchmarks are not part of the default test run. Running them from the
+buildout directory::
+
+    bin/test -a 2 -t test_benchmarks
+
+The size of the dataset can be changed with the environment variables
+`SUPERMODEL_BENCHMARK_CLIENTS` and `SUPERMODEL_BENCHMARK_SAMPLES` (samples
+per client).
+"""
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import Missing
+import six
+import transaction
+from bika.lims import api
+from bika.lims.utils.analysisrequest import create_analysisrequest
+from DateTime import DateTime
+from Products.CMFPlone.utils import safe_callable
+from Products.CMFPlone.utils import safe_hasattr
+from Products.ZCatalog.Catalog import Catalog
+from Products.ZCatalog.Lazy import LazyMap
+from senaite.app.supermodel import SuperModel
+from senaite.app.supermodel.interfaces import ISuperModel
+from senaite.app.supermodel.lazy import LazyList
+from senaite.app.supermodel.lazy import LazyReference
+from senaite.app.supermodel.model import CompactSuperModel
+from senaite.app.supermodel.model import is_uid_list
+from senaite.app.supermodel.model import prefetch
+from senaite.core.catalog import SAMPLE_CATALOG
+
+from .base import SimpleTestCase
+
+CLIENTS = int(os.environ.get("SUPERMODEL_BENCHMARK_CLIENTS", 3))
+SAMPLES = int(os.environ.get("SUPERMODEL_BENCHMARK_SAMPLES", 10))
+
+# Number of runs per benchmark, the fastest run is reported
+REPEAT = 3
+
+
+class Counter(object):
+    """Counts the catalog queries
+    """
+
+    def __init__(self):
+        self.queries = 0
+
+
+@contextmanager
+def count_queries():
+    """Counts the catalog queries within the block
+    """
+    counter = Counter()
+    search = Catalog.searchResults
+
+    def searchResults(self, *args, **kwargs):
+        counter.queries += 1
+        return search(self, *args, **kwargs)
+
+    Catalog.searchResults = searchResults
+    try:
+        yield counter
+    finally:
+        Catalog.searchResults = search
+
+
+class Result(object):
+    """Measurements of a single benchmark
+    """
+
+    def __init__(self, name, items, seconds, queries, loads):
+        self.name = name
+        self.items = items
+        self.seconds = seconds
+        self.queries = queries
+        self.loads = loads
+
+    def __str__(self):
+        items = float(max(self.items, 1))
+        return "{:<32} {:>6} {:>10.3f} {:>10.3f} {:>8.2f} {:>10.2f}".format(
+            self.name, self.items, self.seconds * 1000,
+            self.seconds * 1000 / items, self.queries / items,
+            self.loads / items)
+
+
+def get_size(model):
+    """Returns the size in bytes of the model and its attributes
+    """
+    size = sys.getsizeof(model)
+    try:
+        size += sys.getsizeof(object.__getattribute__(model, "__dict__"))
+    except AttributeError:
+        pass
+    if model._data is not None:
+        size += sys.getsizeof(model._data)
+    return size
+
+
+def legacy_process_value(value):
+    """Conversion chain of `process_value` before the type dispatch
+    """
+    if api.is_uid(value):
+        if value == "0":
+            return "0"
+        return LazyReference(value)
+    elif value is Missing.Value:
+        return None
+    elif api.is_object(value):
+        return LazyReference(value)
+    elif isinstance(value, six.string_types):
+        return six.ensure_str(value)
+    elif isinstance(value, DateTime):
+        return value
+    elif isinstance(value, LazyMap) or is_uid_list(value):
+        return LazyList(value)
+    elif isinstance(value, (list, tuple)):
+        return map(legacy_process_value, value)
+    elif isinstance(value, (dict)):
+        return {k: legacy_process_value(v) for k, v in value.iteritems()}
+    elif safe_callable(value):
+        return legacy_process_value(value())
+    return value
+
+
+def legacy_stringify(value):
+    """Conversion chain of `stringify` before the type dispatch
+    """
+    if ISuperModel.providedBy(value):
+        return str(value)
+    elif value is Missing.Value:
+        return ""
+    elif isinstance(value, (DateTime)):
+        return value.ISO8601()
+    elif safe_hasattr(value, "filename"):
+        return value.filename
+    elif isinstance(value, dict):
+        return {k: legacy_stringify(v) for k, v in value.iteritems()}
+    if isinstance(value, (list, tuple, LazyMap, LazyList)):
+        return map(legacy_stringify, value)
+    elif safe_callable(value):
+        return legacy_stringify(value())
+    elif isinstance(value, six.string_types):
+        value = six.ensure_str(value)
+    return str(value)
+
+
+class TestBenchmarks(SimpleTestCase):
+    """Measures the time, catalog queries and object loads per operation
+    """
+
+    # only run with `bin/test -a 2` or `bin/test --all`
+    level = 2
+
+    def setUp(self):
+        super(TestBenchmarks, self).setUp()
+        self.results = []
+        self.memory = []
+        self.create_dataset()
+
+    def tearDown(self):
+        self.report()
+        super(TestBenchmarks, self).tearDown()
+
+    def create_dataset(self):
+        """Create clients with samples of three analyses each
+        """
+        portal = self.portal
+        bika_setup = portal.bika_setup
+        services = bika_setup.bika_analysisservices
+        sampletype = api.create(
+            bika_setup.bika_sampletypes, "SampleType", title="Water",
+            Prefix="W")
+        self.services = [
+            api.create(services, "AnalysisService", title=keyword,
+                       Keyword=keyword)
+            for keyword in ["Ca", "Mg", "Cu"]]
+        service_uids = map(api.get_uid, self.services)
+
+        self.samples = []
+        for num in range(CLIENTS):
+            client = api.create(
+                portal.clients, "Client", title="Client {}".format(num),
+                ClientID="C{}".format(num))
+            contact = api.create(
+                client, "Contact", Firstname="Contact", Lastname=str(num))
+            values = {
+                "Client": client.UID(),
+                "Contact": contact.UID(),
+                "DateSampled": DateTime().strftime("%Y-%m-%d"),
+                "SampleType": sampletype.UID(),
+            }
+            for _ in range(SAMPLES):
+                sample = create_analysisrequest(
+                    client, self.request, values, service_uids)
+                self.samples.append(sample)
+        transaction.commit()
+
+        self.uids = map(api.get_uid, self.samples)
+
+    def benchmark(self, name, func, items):
+        """Runs the function with cold object caches and records the fastest
+        run
+        """
+        best = None
+        for _ in range(REPEAT):
+            connection = self.portal._p_jar
+            transaction.abort()
+            connection.cacheMinimize()
+            connection.getTransferCounts(clear=True)
+            with count_queries() as counter:
+                start = time.time()
+                func()
+                seconds = time.time() - start
+            loads, _ = connection.getTransferCounts(clear=True)
+            result = Result(name, items, seconds, counter.queries, loads)
+            if best is None or result.seconds < best.seconds:
+                best = result
+        self.results.append(best)
+        return best
+
+    def measure_memory(self, cls, read=None):
+        """Returns the average size of the wrappers of all samples in bytes
+        """
+        models = map(cls, self.brains())
+        if read:
+            for model in models:
+                model.get(read)
+        return sum(map(get_size, models)) / float(len(models))
+
+    def report(self):
+        out = sys.stderr
+        out.write("\n\nSuperModel benchmarks ({} samples)\n".format(
+            len(self.samples)))
+        out.write("{:<32} {:>6} {:>10} {:>10} {:>8} {:>10}\n".format(
+            "operation", "items", "total ms", "ms/item", "q/item",
+            "loads/item"))
+        for result in self.results:
+            out.write("{}\n".format(result))
+        for name, sizes in self.memory:
+            out.write("{:<32} {:>10.1f} bytes/item (SuperModel) "
+                      "{:>10.1f} bytes/item (CompactSuperModel)\n"
+                      .format(name, *sizes))
+
+    def brains(self):
+        return api.search({"portal_type": "AnalysisRequest"}, SAMPLE_CATALOG)
+
+    def test_benchmarks(self):
+        uids = self.uids
+        count = len(uids)
+
+        # UIDs of known portal types are routed to their primary catalog, so
+        # that one instead of two queries are needed to fetch the brain
+        self.benchmark(
+            "construct from UID",
+            lambda: [SuperModel(uid).brain for uid in uids], count)
+
+        self.benchmark(
+            "construct from brain",
+            lambda: [SuperModel(brain) for brain in self.brains()], count)
+
+        self.benchmark(
+            "construct with from_brain",
+            lambda: map(SuperModel.from_brain, self.brains()), count)
+
+        # one uid_catalog query and one query per primary catalog
+        result = self.benchmark(
+            "construct with from_uids",
+            lambda: SuperModel.from_uids(uids), count)
+        self.assertLessEqual(result.queries, 2)
+
+        self.benchmark(
+            "get metadata value",
+            lambda: [SuperModel(brain).get("getClientTitle")
+                     for brain in self.brains()], count)
+
+        self.benchmark(
+            "get field value",
+            lambda: [SuperModel(brain).get("CCEmails")
+                     for brain in self.brains()], count)
+
+        self.benchmark(
+            "traverse reference",
+            lambda: [SuperModel(brain).Client.Name
+                     for brain in self.brains()], count)
+
+        self.benchmark(
+            "traverse prefetched reference",
+            lambda: [model.Client.Name for model in prefetch(
+                map(SuperModel, self.brains()), ["Client"])], count)
+
+        self.benchmark(
+            "to_dict",
+            lambda: [SuperModel(brain).to_dict()
+                     for brain in self.brains()], count)
+
+        self.benchmark(
+            "to_dict (metadata only)",
+            lambda: [SuperModel(brain).to_dict(metadata_only=True)
+                     for brain in self.brains()], count)
+
+        names = ["getClientTitle", "review_state", "created", "getId"]
+        self.benchmark(
+            "get metadata values per row",
+            lambda: [[SuperModel(brain).stringify(SuperModel(brain).get(name))
+                      for name in names] for brain in self.brains()], count)
+
+        self.benchmark(
+            "get metadata values by column",
+            lambda: SuperModel.columns(self.brains(), names), count)
+
+        self.benchmark(
+            "to_json",
+            lambda: [SuperModel(brain).to_json()
+                     for brain in self.brains()], count)
+
+    def test_converters(self):
+        model = SuperModel(self.uids[0])
+        values = [
+            "Some text", u"Unicode text", 42, 3.14, True, None, DateTime(),
+            Missing.Value, ["a", "b", 1, 2], {"key": "value", "number": 1},
+        ] * 1000
+        count = len(values)
+
+        # warm up the handler caches
+        map(model.process_value, values)
+        map(model.stringify, values)
+
+        self.benchmark(
+            "process_value (if/elif chain)",
+            lambda: map(legacy_process_value, values), count)
+
+        self.benchmark(
+            "process_value (type dispatch)",
+            lambda: map(model.process_value, values), count)
+
+        self.benchmark(
+            "stringify (if/elif chain)",
+            lambda: map(legacy_stringify, values), count)
+
+        self.benchmark(
+            "stringify (type dispatch)",
+            lambda: map(model.stringify, values), count)
+
+        self.assertEqual(
+            map(model.stringify, values), map(legacy_stringify, values))
+
+    def test_memory(self):
+        for name, read in [("memory (empty)", None),
+                           ("memory (one cached field)", "CCEmails")]:
+            sizes = (self.measure_memory(SuperModel, read=read),
+                     self.measure_memory(CompactSuperModel, read=read))
+            self.memory.append((name, sizes))
+            self.assertLess(sizes[1], sizes[0])
+
+
+def test_suite():
+    from unittest import TestSuite, makeSuite
+    suite = TestSuite()
+    suite.addTest(makeSuite(TestBenchmarks))
+    return suite